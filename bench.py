@@ -0,0 +1,435 @@
+#! /usr/bin/env python3     # -*-python-*-
+# coding: utf-8
+# bench --  Benchmarks for f.py that run without the UM1 service
+# Each measurement runs in a fresh python process so peak RSS figures are not polluted by earlier measurements
+# "load" runs f.py end to end on generated test files against um1stub and compares throughput and memory with a stored baseline
+# "service" load tests semsimservice.py against um1stub with many concurrent clients
+# Use this code at your own risk any way you want
+
+import sys, os, io, json, time, random, string, argparse, subprocess, tempfile, resource, contextlib, asyncio
+
+def peakrsskb():                                                                # Peak resident set size of this process so far. Linux reports KB, macOS reports bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def drawoverlap(rng, overlap):                                                  # Overlap is either a fraction or a (low, high) range to draw a fraction from uniformly for each test
+    return rng.uniform(*overlap) if isinstance(overlap, (tuple, list)) else overlap
+
+def writesyntheticresponse(path, tests, candidates, topn, overlap=0.0, seed=1): # Write a UM1-style response body with tests test cases of 1 + candidates moniforms of topn concept ids each, written one test case at a time
+    rng = random.Random(seed)
+    with open(path, "w") as out:
+        out.write('{"ms": 1234, "competenceuuid": "00000000-0000-0000-0000-000000000000", "totalticks": 1, "moniform": [')
+        for test in range(tests):
+            if test: out.write(",")
+            json.dump(synthetictestcase(rng, candidates, topn, drawoverlap(rng, overlap)), out)
+        out.write('], "uptimesecs": 1}')
+
+def checkdecode():                                                             # Decode sample bodies split into two chunks at every byte offset, and byte by byte, and compare with json.loads. Returns number of mismatches
+    import f
+    bodies = ['{"ms": 1.5, "moniform": [[[1, 2, 3], [4], []], [[5, -6], [70000000000], [2, 1]]], "totalticks": 12e3, "uptimesecs": -4.25E-2}',
+              '{"moniform": [], "error": null, "flag": true, "competenceuuid": "\\u00e9t\\u00e9 \\"quoted\\" \u00e9t\u00e9 \u2603 \U0001F600"}',
+              ' { "ms" : 0 , "moniform" : [ [ [ 10 , 20 ] , [ 20 ] , [ 30 ] ] ] , "nested" : { "a" : [ 1.0 , { "b" : -0.5e+1 } ] } } ',
+              '{"ms":1.5}', '{}']
+    mismatches = 0
+    for body in bodies:
+        data = body.encode("utf-8")
+        expected = json.loads(body)
+        splits = [[data[:offset], data[offset:]] for offset in range(len(data) + 1)] + [[data[offset:offset + 1] for offset in range(len(data))]]
+        for chunks in splits:
+            try:
+                decoded = f.decodeunderstanding(chunks)
+                decoded = json.loads(json.dumps(decoded, default=list))         # Compact arrays back to lists for comparison
+            except Exception as err:
+                decoded = f"{type(err).__name__}: {err}"
+            if decoded != expected:
+                mismatches += 1
+                print(f"  MISMATCH for chunks {chunks[:2]}{'...' if len(chunks) > 2 else ''}: {decoded}")
+    print(f"Incremental decoding of {len(bodies)} bodies split at every byte offset and byte by byte: {mismatches} mismatches")
+    return mismatches
+
+def checkindex():                                                               # Compare InvertedIndex with brute force on small adversarial corpora, every document as the query, with and without excluding it. Returns number of mismatches
+    import moniformindex
+    rng = random.Random(3)
+    corpora = [[[1, 2, 3, 4], [4, 5], [1, 20, 21, 22, 23, 24, 25]] + [[4, 100 + i] for i in range(5)],   # Many small documents sharing the query's commonest concept, one larger with its rarest
+               [[1, 2], [1, 2], [1, 2, 3], [2], [1], [3, 4, 5, 6], [1, 2]],                               # Duplicates and exact ties
+               [rng.sample(range(12), rng.randint(1, 6)) for document in range(60)],                      # Dense random corpus with a small vocabulary, so scores tie often
+               [rng.sample(range(200), rng.randint(1, 30)) for document in range(60)]]
+    mismatches = 0; searches = 0
+    for documents in corpora:
+        index = moniformindex.InvertedIndex()
+        index.addall(range(len(documents)), documents)
+        for number, query in enumerate(documents):
+            for k in (1, 2, 3, 10):
+                for threshold in (0.0, 0.2, 0.5):
+                    for exclude in (None, number):
+                        searches += 1
+                        expected = moniformindex.bruteforce(documents, query, k, threshold, exclude)
+                        found = [(score, documentnumber) for score, documentnumber, key in index.search(query, k, threshold, exclude)]
+                        if found != expected:
+                            mismatches += 1
+                            print(f"  MISMATCH for query {query} k {k} threshold {threshold} exclude {exclude}: {found} instead of {expected}")
+    print(f"Exact index against brute force on {len(corpora)} adversarial corpora: {searches} searches, {mismatches} mismatches")
+    return mismatches
+
+def syntheticvocabulary(words, seed=1):                                         # Distinct lowercase pseudo-words of 2 to 10 letters
+    rng = random.Random(seed)
+    vocabulary = set()
+    while len(vocabulary) < words:
+        vocabulary.add("".join(rng.choice(string.ascii_lowercase) for letter in range(rng.randint(2, 10))))
+    return sorted(vocabulary)
+
+def writesynthetictsv(path, lines, candidates=5, words=12, overlap=(0.3, 0.8), vocabulary=20000, seed=1):   # Write a test file in the chat-200.tsv format, one line at a time so any size fits.
+    rng = random.Random(seed)                                                   # Each line has a truth, a target question of about words words and candidates of which the truth-th rephrases the target,
+    vocabulary = syntheticvocabulary(vocabulary, seed)                          # keeping a fraction of its words drawn from overlap. um1stub gives each word its own concept, so word overlap becomes moniform overlap
+    sentence = lambda: [rng.choice(vocabulary) for word in range(rng.randint(max(1, words // 2), words + words // 2))]
+    with open(path, "w") as out:
+        for line in range(lines):
+            target = sentence()
+            keep = drawoverlap(rng, overlap)
+            rephrase = [word if rng.random() < keep else rng.choice(vocabulary) for word in target]
+            truth = rng.randrange(candidates)
+            others = [sentence() for candidate in range(candidates - 1)]
+            others.insert(truth, rephrase)
+            out.write("\t".join([str(truth)] + [" ".join(question).capitalize() + "?" for question in [target] + others]) + "\n")
+
+def decodeonce(mode, path):                                                     # Decode response body in path the way understand() does in the given mode. Runs in a child process
+    import f
+    rssbefore = peakrsskb()
+    start = time.perf_counter()
+    with open(path, "rb") as body:
+        if mode == "json":
+            understanding = json.loads(body.read().decode("utf-8"))             # What response.json() does: whole body as bytes, then as text, then as python objects
+        else:
+            understanding = f.decodeunderstanding(iter(lambda: body.read(65536), b""))
+    seconds = time.perf_counter() - start
+    return {"mode": mode, "tests": len(understanding["moniform"]), "seconds": round(seconds, 3), "peakrsskb": peakrsskb(), "rssgrowthkb": peakrsskb() - rssbefore}
+
+def syntheticcorpus(documents, topn, families=None, keep=0.7, concepts=50000, seed=1):   # Documents in families: each family member keeps about a fraction keep of the family's concepts and fills up with random ones
+    rng = random.Random(seed)
+    families = families or max(1, documents // 5)
+    bases = [rng.sample(range(concepts), topn) for family in range(families)]
+    corpus = []
+    for document in range(documents):
+        base = bases[rng.randrange(families)]
+        kept = [concept for concept in base if rng.random() < keep]
+        extra = set(kept)
+        while len(extra) < topn: extra.add(rng.randrange(concepts))
+        corpus.append(kept + [concept for concept in extra if concept not in kept][:topn - len(kept)])
+    return corpus
+
+def chatcorpus(topn, service=None):                                             # All strings in chat-200.tsv, understood by UM1 at service, or by the um1stub synthetic understander if no service is given
+    import f, um1stub
+    texts = list(dict.fromkeys(text for truth, strings, line in f.readtests() for text in strings))
+    if not service:
+        return texts, [um1stub.syntheticmoniform(text, topn) for text in texts]
+    f.um1service = service
+    understanding = f.understand(texts, {"topn": topn})
+    return texts, understanding["moniform"]
+
+def benchindex(corpora, k, queries, bands, rows):                               # Build exact and MinHash indexes over each (name, keys, moniforms, threshold) corpus and compare their top-k above threshold with brute force Jaccard
+    import moniformindex
+    for name, keys, moniforms, threshold in corpora:
+        rng = random.Random(2)
+        querynumbers = rng.sample(range(len(moniforms)), min(queries, len(moniforms)))
+        start = time.perf_counter()
+        truths = [moniformindex.bruteforce(moniforms, moniforms[number], k, threshold, exclude=number) for number in querynumbers]
+        brutems = 1000 * (time.perf_counter() - start) / len(querynumbers)
+        print(f"{name}: {len(moniforms)} documents, {len(querynumbers)} queries, {sum(map(len, truths)) / len(truths):.1f} true neighbors per query at Jaccard >= {threshold}, brute force {brutems:.3f} ms/query")
+        for index in (moniformindex.InvertedIndex(), moniformindex.MinHashIndex(bands, rows)):
+            start = time.perf_counter()
+            index.addall(keys, moniforms)
+            buildseconds = time.perf_counter() - start
+            found = 0; expected = 0; candidates = 0
+            start = time.perf_counter()
+            for number, truth in zip(querynumbers, truths):
+                results = index.search(moniforms[number], k, threshold, exclude=number)
+                found += len({documentnumber for score, documentnumber in truth} & {documentnumber for score, documentnumber, key in results})
+                expected += len(truth)
+            queryms = 1000 * (time.perf_counter() - start) / len(querynumbers)
+            for number in querynumbers: candidates += len(index.candidates(set(moniforms[number]), k, threshold, number))
+            recall = f"{found / expected:.3f}" if expected else "n/a"             # Nothing to find means nothing was measured
+            print(f"  {type(index).__name__:<14} build {buildseconds:>7.2f} s   query {queryms:>8.3f} ms   recall@{k} {recall:>5} of {expected:<5} candidates verified per query {candidates // len(querynumbers)}")
+
+def synthetictestcase(rng, candidates, topn, overlap, concepts=100000):       # Understood test case: a target, one candidate sharing about overlap of its concepts, and unrelated candidates
+    target = rng.sample(range(concepts), topn)
+    shared = [concept for concept in target if rng.random() < overlap]
+    rephrase = shared + [concept for concept in rng.sample(range(concepts), topn) if concept not in target][:topn - len(shared)]
+    others = [rng.sample(range(concepts), topn) for candidate in range(candidates - 1)]
+    others.insert(rng.randrange(candidates), rephrase)
+    return [target] + others
+
+def synthetictestcases(tests, candidates, topn, overlap=0.3, concepts=100000, seed=1):
+    rng = random.Random(seed)
+    return [synthetictestcase(rng, candidates, topn, drawoverlap(rng, overlap), concepts) for test in range(tests)]
+
+def benchscore(tests, candidates, topn, processcounts, compact):                         # Time scoring of one batch serially and with scoreparallel() at each process count, and check the results are identical
+    import f
+    testcases = synthetictestcases(tests, candidates, topn)
+    if compact: testcases = [[f.compactmoniforms(moniform) for moniform in testcase] for testcase in testcases]
+    start = time.perf_counter()
+    serial = f.scoretestcases(testcases)
+    serialseconds = time.perf_counter() - start
+    print(f"Scoring {tests} tests of {1 + candidates} moniforms of {topn} concepts held as {'arrays as from incrementaldecode' if compact else 'lists'} on {os.cpu_count()} cores")
+    print(f"  serial       {serialseconds:>8.3f} s   {'with NumPy' if f.numpy is not None and f.usenumpy else 'python loop'}")
+    if f.numpy is not None and f.usenumpy:
+        start = time.perf_counter()
+        loop = f.scoreloop(testcases)
+        print(f"  python loop  {time.perf_counter() - start:>8.3f} s   {'identical' if loop == serial else 'DIFFERENT'}")
+    for processes in processcounts:
+        f.scoringprocesses = processes
+        f.scoringpool = None
+        f.scoreparallel(testcases[:processes * 4])                              # Start the pool outside the measurement
+        start = time.perf_counter()
+        parallel = f.scoreparallel(testcases)
+        seconds = time.perf_counter() - start
+        f.scoringpool.shutdown()
+        print(f"  {processes:>2} processes {seconds:>8.3f} s   speedup {serialseconds / seconds:>5.2f}   {'identical' if parallel == serial else 'DIFFERENT'}")
+
+def runchild(*args, cwd=None):                                                  # Run this script with args in a fresh process and return the JSON result it prints
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), *args], check=True, capture_output=True, text=True, cwd=cwd or os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output.splitlines()[-1])
+
+def benchdecode(tests, candidates, topn):                                       # Compare decode time and peak RSS of response.json() and incremental decoding
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "response.json")
+        writesyntheticresponse(path, tests, candidates, topn)
+        print(f"Decoding a {os.path.getsize(path) // 1024} KB response with {tests} tests of {1 + candidates} moniforms of {topn} concepts")
+        for mode in ("json", "incremental"):
+            result = runchild("decodeonce", mode, path)
+            print(f"  {mode:<12} {result['seconds']:>8.3f} s   peak RSS {result['peakrsskb'] // 1024:>6} MB   growth during decode {result['rssgrowthkb'] // 1024:>6} MB")
+
+loadstages = ["createpayload", "understand", "classifyunderstandings", "classifyall"]
+
+def loadonce(stage, path, service, topn, streambatchsize):                      # Time one f.py stage on test file path against service. Earlier stages it depends on run before the measurement. Runs in a child process
+    import f
+    f.testpath = path; f.maxtestlines = None; f.um1service = service
+    f.logjaccard = False; f.logoutcomes = False; f.logprogress = False; f.telemetry = False
+    options = {"topn": topn, "debug": False}
+    rssbefore = peakrsskb()
+    error = None
+    with contextlib.redirect_stdout(io.StringIO()):                             # Keep f.py's report out of our JSON result line
+        start = time.perf_counter()
+        if stage == "classifyall":
+            f.streambatchsize = streambatchsize
+            stats = f.classifyall(options)
+            tests = stats["testsdone"] if stats else 0
+            if not tests: error = "UM-1 gave no understanding for any batch"
+        else:
+            f.payload = f.createpayload()
+            tests = len(f.payload)
+            if stage != "createpayload":
+                start = time.perf_counter()
+                understandings = f.understand(f.payload, options)
+                if not understandings or understandings.get("error") or not understandings.get("moniform"):
+                    tests = 0; error = (understandings or {}).get("error") or "UM-1 gave no understanding"   # Retries used up. Nothing was understood, so there is no throughput to report
+            if stage == "classifyunderstandings" and not error:
+                start = time.perf_counter()
+                with open("semsimout.txt", "a") as of:
+                    f.classifyunderstandings(understandings, of)
+                tests = f.testsdone
+        seconds = time.perf_counter() - start
+    return {"stage": stage, "tests": tests, "chars": f.totaltestchars, "seconds": round(seconds, 3), "testspersecond": round(tests / max(seconds, 1e-6)), "charspersecond": round(f.totaltestchars / max(seconds, 1e-6)) if tests else 0,
+            "peakrsskb": peakrsskb(), "rssgrowthkb": peakrsskb() - rssbefore, "error": error}
+
+def runloadonce(stage, path, service, topn, streambatchsize, cwd):                # Run loadonce in a fresh process. A child that crashed gives a failed result instead of stopping the whole load test
+    try:
+        return runchild("loadonce", stage, path, service, str(topn), str(streambatchsize or 0), cwd=cwd)
+    except subprocess.CalledProcessError as err:
+        lines = (err.stderr or "").strip().splitlines()
+        return {"stage": stage, "tests": 0, "seconds": 0.0, "error": lines[-1] if lines else f"exit status {err.returncode}"}
+
+def benchload(linecounts, candidates, words, overlap, topn, latency, failrate, streambatchsize, stages, baselinepath, save, tolerance, keep, repeat):   # Run each stage on a synthetic test file of each size, best of repeat runs, and compare with the baseline
+    import um1stub
+    server, service = um1stub.startstub(latency=latency, failures=failrate)
+    baseline = {}
+    if os.path.exists(baselinepath):
+        with open(baselinepath) as infile: baseline = json.load(infile)
+    results = {}; regressions = 0; failures = 0
+    configuration = "/".join(f"{name}={value}" for name, value in [("stream", streambatchsize or 0), ("latency", latency), ("failrate", failrate), ("topn", topn),
+                                                                   ("candidates", candidates), ("words", words), ("overlap", "-".join(map(str, overlap)))])
+    print(f"Load test against um1stub (latency {latency} ms, failrate {failrate}) with {1 + candidates} strings of about {words} words per test, rephrase overlap {overlap}, topn {topn}, baseline {baselinepath}")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for lines in linecounts:
+                path = os.path.join(keep or tmp, f"synthetic-{lines}.tsv")
+                if not os.path.exists(path): writesynthetictsv(path, lines, candidates, words, overlap)
+                print(f"{lines} lines, {os.path.getsize(path) // 1024} KB")
+                for stage in stages:
+                    result = min((runloadonce(stage, path, service, topn, streambatchsize, tmp) for run in range(repeat)), key=lambda result: (bool(result["error"]), result["seconds"]))
+                    key = f"{stage}/{lines}/{configuration}"                  # Results are only compared with a baseline measured the same way
+                    if result["error"]:                                         # Every run failed. Report it and go on with the next measurement, but neither compare nor save it
+                        failures += 1
+                        print(f"  {stage:<24} FAILED in all {repeat} runs: {result['error']}")
+                        continue
+                    results[key] = result
+                    comparison = "   no baseline for this configuration"
+                    if key in baseline:
+                        old = baseline[key]
+                        speed = result["testspersecond"] / max(1, old["testspersecond"]) - 1
+                        memory = result["peakrsskb"] / max(1, old["peakrsskb"]) - 1
+                        regressed = speed < -tolerance or memory > tolerance
+                        regressions += regressed
+                        comparison = f"   vs baseline: speed {100 * speed:+6.1f}%  memory {100 * memory:+6.1f}%{'   REGRESSION' if regressed else ''}"
+                    print(f"  {stage:<24} {result['seconds']:>8.3f} s {result['testspersecond']:>9} tests/s {result['charspersecond']:>11} chars/s   peak RSS {result['peakrsskb'] // 1024:>6} MB{comparison}")
+    finally:
+        server.shutdown()
+    if save:
+        baseline.update(results)
+        with open(baselinepath, "w") as out: json.dump(baseline, out, indent=1, sort_keys=True)
+        print(f"Saved {len(results)} results to {baselinepath}")
+    if failures: print(f"{failures} measurements failed in every run")
+    return regressions + failures
+
+async def postjson(reader, writer, path, request):                             # One request on a keep-alive HTTP/1.1 connection. Returns (status, reply)
+    body = json.dumps(request).encode("utf-8")
+    writer.write(f"POST {path} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""): break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length": length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+async def serviceclients(port, tests, requests, concurrency):                  # Send requests requests drawn round robin from tests over concurrency connections, each waiting for its answer before sending the next
+    counter = iter(range(requests))
+    outcomes = []                                                               # (latency seconds, status, correct)
+    async def client():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            for number in counter:
+                truth, strings, line = tests[number % len(tests)]
+                start = time.perf_counter()
+                status, reply = await postjson(reader, writer, "/classify", {"target": strings[0], "candidates": strings[1:]})
+                outcomes.append((time.perf_counter() - start, status, status == 200 and reply["winner"] == truth))
+        finally:
+            writer.close()
+    await asyncio.gather(*[client() for connection in range(concurrency)])
+    return outcomes
+
+async def benchserviceonce(tests, requests, concurrency, batchsize, waitms):   # Load test one service configuration. Returns (outcomes, seconds, service metrics)
+    import semsimservice
+    semsimservice.maxbatchsize = batchsize; semsimservice.maxwaitms = waitms
+    server = await semsimservice.startservice(port=0)
+    try:
+        start = time.perf_counter()
+        outcomes = await serviceclients(server.sockets[0].getsockname()[1], tests, requests, concurrency)
+        return outcomes, time.perf_counter() - start, semsimservice.metrics()
+    finally:
+        server.close()
+
+def benchservice(path, requests, concurrency, batchsizes, waitms, topn, latency, failrate):   # Compare throughput, latency and UM1 round trips of the service at each maximum batch size
+    import f, um1stub, semsimservice
+    server, f.um1service = um1stub.startstub(latency=latency, failures=failrate)
+    f.testpath = path; f.maxtestlines = None
+    semsimservice.options["topn"] = topn
+    tests = list(f.readtests())
+    print(f"Service load test: {requests} requests from {path} over {concurrency} connections, um1stub latency {latency} ms, failrate {failrate}, maxwaitms {waitms}")
+    try:
+        for batchsize in batchsizes:
+            um1requests = um1stub.requestcount
+            outcomes, seconds, metrics = asyncio.run(benchserviceonce(tests, requests, concurrency, batchsize, waitms))
+            um1requests = um1stub.requestcount - um1requests
+            latencies = f.percentiles([latency for latency, status, correct in outcomes], 1000)
+            answered = sum(1 for latency, status, correct in outcomes if status == 200)
+            correct = sum(1 for latency, status, correct in outcomes if correct)
+            print(f"  maxbatchsize {batchsize:>4}: {len(outcomes) / seconds:>8.1f} requests/s   latency p50/p95/p99 {latencies['p50']}/{latencies['p95']}/{latencies['p99']} ms   "
+                  f"{metrics['batches']} batches, mean {metrics['meanbatchsize']} ({100 * metrics['meanbatchfill']:.0f}% full)   {um1requests} UM1 requests   "
+                  f"{answered} answered, accuracy {100.0 * correct / max(1, answered):.1f}%")
+    finally:
+        server.shutdown()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks for f.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+    decode = commands.add_parser("decode", help="compare response.json() with incremental decoding")
+    decode.add_argument("--tests", type=int, default=100000)
+    decode.add_argument("--candidates", type=int, default=5)
+    decode.add_argument("--topn", type=int, default=60)
+    index = commands.add_parser("index", help="recall@k and speed of moniformindex against brute force Jaccard")
+    index.add_argument("--documents", type=int, nargs="*", default=[10000, 50000], help="sizes of synthetic corpora")
+    index.add_argument("--topn", type=int, default=60)
+    index.add_argument("--k", type=int, default=10)
+    index.add_argument("--threshold", type=float, default=0.2, help="only neighbors at least this similar count towards recall in the synthetic corpora")
+    index.add_argument("--chatthreshold", type=float, default=0.0, help="the same for chat-200.tsv, whose questions are mostly unrelated to each other")
+    index.add_argument("--queries", type=int, default=200)
+    index.add_argument("--bands", type=int, default=32)
+    index.add_argument("--rows", type=int, default=2)
+    index.add_argument("--service", help="UM1 URL to understand chat-200.tsv with. Default is synthetic moniforms from um1stub")
+    score = commands.add_parser("score", help="speedup of parallel scoring against cores")
+    score.add_argument("--tests", type=int, default=200000)
+    score.add_argument("--candidates", type=int, default=5)
+    score.add_argument("--topn", type=int, default=60)
+    score.add_argument("--processes", type=int, nargs="*", help="process counts to try. Default is powers of two up to the number of cores")
+    score.add_argument("--compact", action="store_true", help="hold moniforms as compact arrays, as incrementaldecode does")
+    synthetic = commands.add_parser("synthetic", help="write a synthetic test file, and optionally a synthetic UM1 response")
+    synthetic.add_argument("path", help="test file to write")
+    synthetic.add_argument("--lines", type=int, default=200)
+    synthetic.add_argument("--candidates", type=int, default=5)
+    synthetic.add_argument("--words", type=int, default=12, help="average words per question")
+    synthetic.add_argument("--overlap", type=float, nargs=2, default=[0.3, 0.8], metavar=("LOW", "HIGH"), help="range of the fraction of target words (or concepts) the rephrase keeps")
+    synthetic.add_argument("--response", help="also write a UM1 response body of --lines tests with moniforms of --topn concepts to this file")
+    synthetic.add_argument("--topn", type=int, default=60)
+    load = commands.add_parser("load", help="throughput and memory of f.py stages on synthetic test files against um1stub, compared with a baseline")
+    load.add_argument("--lines", type=int, nargs="*", default=[200, 2000], help="test file sizes. Anything from 200 to 10000000, use --stream for the large ones")
+    load.add_argument("--candidates", type=int, default=5)
+    load.add_argument("--words", type=int, default=12)
+    load.add_argument("--overlap", type=float, nargs=2, default=[0.3, 0.8], metavar=("LOW", "HIGH"))
+    load.add_argument("--topn", type=int, default=60)
+    load.add_argument("--latency", type=int, default=0, help="milliseconds um1stub adds to each request")
+    load.add_argument("--failrate", type=float, default=0.0, help="fraction of requests um1stub fails, to exercise retries")
+    load.add_argument("--stream", type=int, default=0, help="streambatchsize for classifyall. 0=whole file as one payload")
+    load.add_argument("--stages", nargs="*", choices=loadstages, default=loadstages)
+    load.add_argument("--baseline", default="benchbaseline.json", help="stored results to compare with")
+    load.add_argument("--save", action="store_true", help="store these results in the baseline file")
+    load.add_argument("--tolerance", type=float, default=0.1, help="report a regression when speed drops or peak memory grows by more than this fraction")
+    load.add_argument("--repeat", type=int, default=3, help="run each measurement this many times and keep the fastest, to lower timing noise")
+    load.add_argument("--keep", help="directory to write and reuse the synthetic test files in. Default is a temporary directory")
+    service = commands.add_parser("service", help="load test the micro-batching semsimservice.py against um1stub")
+    service.add_argument("--path", default="chat-200.tsv", help="test file to draw requests from, for example one written by bench.py synthetic")
+    service.add_argument("--requests", type=int, default=2000)
+    service.add_argument("--concurrency", type=int, default=64, help="number of client connections, each with one request outstanding")
+    service.add_argument("--batchsizes", type=int, nargs="*", default=[1, 8, 64], help="maxbatchsize values to compare. 1 is one UM1 round trip per request")
+    service.add_argument("--maxwaitms", type=float, default=10)
+    service.add_argument("--topn", type=int, default=60)
+    service.add_argument("--latency", type=int, default=20, help="milliseconds um1stub adds to each request")
+    service.add_argument("--failrate", type=float, default=0.0)
+    commands.add_parser("decodecheck", help="check incremental decoding against json.loads with bodies split at every byte offset")
+    commands.add_parser("indexcheck", help="check the exact moniformindex against brute force Jaccard on adversarial corpora")
+    once = commands.add_parser("decodeonce")                                    # Internal: one measurement in a child process
+    once.add_argument("mode", choices=["json", "incremental"])
+    once.add_argument("path")
+    loadchild = commands.add_parser("loadonce")                                 # Internal: one measurement in a child process
+    loadchild.add_argument("stage", choices=loadstages)
+    loadchild.add_argument("path")
+    loadchild.add_argument("service")
+    loadchild.add_argument("topn", type=int)
+    loadchild.add_argument("streambatchsize", type=int)
+    args = parser.parse_args()
+    if args.command == "decode":
+        benchdecode(args.tests, args.candidates, args.topn)
+    elif args.command == "index":
+        corpora = [("chat-200.tsv", *chatcorpus(args.topn, args.service), args.chatthreshold)]
+        corpora += [(f"synthetic-{documents}", list(range(documents)), syntheticcorpus(documents, args.topn), args.threshold) for documents in args.documents]
+        benchindex(corpora, args.k, args.queries, args.bands, args.rows)
+    elif args.command == "score":
+        processcounts = args.processes or [2 ** power for power in range(os.cpu_count().bit_length()) if 2 ** power <= os.cpu_count()] + ([os.cpu_count()] if os.cpu_count() & (os.cpu_count() - 1) else [])
+        benchscore(args.tests, args.candidates, args.topn, processcounts, args.compact)
+    elif args.command == "synthetic":
+        writesynthetictsv(args.path, args.lines, args.candidates, args.words, args.overlap)
+        if args.response: writesyntheticresponse(args.response, args.lines, args.candidates, args.topn, args.overlap)
+    elif args.command == "load":
+        sys.exit(1 if benchload(args.lines, args.candidates, args.words, args.overlap, args.topn, args.latency, args.failrate, args.stream, args.stages,
+                                args.baseline, args.save, args.tolerance, args.keep, args.repeat) else 0)
+    elif args.command == "service":
+        benchservice(args.path, args.requests, args.concurrency, args.batchsizes, args.maxwaitms, args.topn, args.latency, args.failrate)
+    elif args.command == "decodecheck":
+        sys.exit(1 if checkdecode() else 0)
+    elif args.command == "indexcheck":
+        sys.exit(1 if checkindex() else 0)
+    elif args.command == "decodeonce":
+        print(json.dumps(decodeonce(args.mode, args.path)))
+    elif args.command == "loadonce":
+        print(json.dumps(loadonce(args.stage, args.path, args.service, args.topn, args.streambatchsize or None)))
@@ -5,9 +5,22 @@
 # Code by Monica Anderson monica@syntience.com 20200811
 # Use this code at your own risk any way you want
 
-import sys, os, requests, urllib, json, colorama, time
+import sys, os, requests, urllib, json, colorama, time, sqlite3, hashlib, threading, codecs, gc, csv, argparse, cProfile, pstats, tracemalloc
+from array import array
+from bisect import bisect_left
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from itertools import accumulate, chain
+from operator import attrgetter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
 from colorama import Fore, Style
 from datetime import datetime
+try:
+    import numpy                                                                # Optional. Without it scoring uses the plain python loop, with identical results
+except ImportError:
+    numpy = None
 
 logtraffic = False                                                              # Set this True to see UM1 network traffic
 logjaccard = True                                                              # Demonstrate jaccard score as a distance measure over sets. If this is True, then logoutomes should be set False to avoid ugly output
@@ -20,8 +33,29 @@ logmoniforms = False
 testpath = 'chat-200.tsv'                                                       # Test file with 200 string classification tests based on data form Quora Question Pairs (QQP) test benchmark. Feel free to edit those or provide a different file
 maxtestlines = 200                                                              # Limit tests to this many lines. None=all test cases in file. Larger files (2000 test cases) are available
 writefailurefile = False                                                        # Write failedtests.tsv file of all failing test cases
+resultspath = None                                                              # Write a CSV table of per-test results (test, truth, winner, scores, margin, ties, outcome) to this file for offline analysis. None=do not write
+telemetry = True                                                                # Time each stage of the run, print a breakdown and append a JSON telemetry record for each run to telemetrypath
+telemetrypath = 'semsimtelemetry.jsonl'                                         # One JSON object per line, written next to semsimout.txt
+telemetrywindow = 100000                                                        # Chunk latency percentiles are over this many most recent chunks, so a long-running process such as semsimservice.py does not grow
+streambatchsize = None                                                          # Stream the test file: read, understand, score and report this many test cases at a time, in constant memory. None=read entire file into one payload
+maxbatchesinflight = 2                                                          # When streaming, number of batches being understood by UM1 while we score the oldest one
+logprogress = True                                                              # When streaming, print a progress line after each batch has been scored. Not printed if logoutcomes is True
+scoringprocesses = 1                                                            # Score test cases in this many processes, sharing the moniforms through shared memory. 1=score in this process. None=one per core. Pays off with incrementaldecode
+parallelminimum = 5000                                                          # Batches with fewer test cases than this are always scored in this process because starting the work costs more than it saves
+usenumpy = True                                                                 # Score batches with bulk NumPy set arithmetic when NumPy is installed
+sweepcheck = 20                                                                 # In a topn sweep, re-request this many test cases at each smaller topn to check that their moniforms are prefixes of the largest. 0=do not check
 
 um1service = "https://free.understanding-machines.com/understand"            # The servicce to use
+chunksize = 500                                                                 # Send at most this many test cases per request to UM1. None=send entire payload as one request
+maxconnections = 4                                                              # Number of chunks in flight at the same time. Each uses its own pooled keep-alive connection
+maxretries = 3                                                                  # Retry a failed chunk this many times before giving up on it
+retrybackoff = 1.0                                                              # Seconds to wait before first retry of a chunk. Doubled for each following retry
+requesttimeout = 300                                                            # Seconds to wait for UM1 to respond to a single chunk
+incrementaldecode = False                                                       # Decode UM1 responses one test case at a time as they arrive, into compact integer arrays instead of lists of python ints
+
+usecache = False                                                                # Look up moniforms in a local cache and only send strings we have not seen before to UM1. Duplicate strings in a payload are then also sent only once
+cachepath = 'moniformcache.sqlite'                                              # SQLite file holding the cache. Keyed by text, options and server competenceuuid so a relearned server never gets stale answers
+cachemaxentries = 5000000                                                       # Evict least recently used moniforms when the cache grows beyond this many entries. None=unbounded
 
 payload = None                                                                  # Global copy of payload so we can retrieve the texts we sent in when processing the results
 testsdone = 0                                                                   # How many test cases that actually returned data to analyze
@@ -30,207 +64,787 @@ totaltestchars = 0
 numberunderstandings = 0                                                        # Total number of strings sent to Understander -- normally 6 per test
 truths = []                                                                     # Correct answers -- never sent to UM1
 alllines = []                                                                   # Array of input lines -- one test case each
+resultscolumns = ["test", "truth", "winner", "winnerscore", "runnerupscore", "margin", "ambiguous", "outcome", "jaccard"]   # Columns of the resultspath CSV table
+session = None                                                                  # Pooled requests.Session shared by all chunks. Created on first use
+cache = None                                                                    # Open sqlite3 connection to cachepath. Opened on first use
+cachelock = threading.Lock()                                                    # Streamed batches are understood in worker threads, so cache access is serialized
+scoringpool = None                                                              # ProcessPoolExecutor for parallel scoring. Started on first use and reused for all batches
+workermemory = None                                                             # In a scoring worker: the shared memory block of the batch being scored
+telemetrylock = threading.Lock()                                                # Chunks and batches are timed in several threads
+stageseconds = {}                                                               # Stage name -> seconds spent in it this run, summed over threads
+chunklatencies = deque(maxlen=telemetrywindow)                                  # Seconds from sending each recent chunk to having it decoded, including retries
+chunkservicems = deque(maxlen=telemetrywindow)                                  # Server side time ("ms") reported for each recent chunk
+chunklatencytotal = 0.0                                                         # Sums over all chunks this run, not only the recent ones
+chunkservicetotal = 0.0
+bytessent = 0                                                                   # Request bytes sent to UM1 this run
+bytesreceived = 0                                                               # Response bytes received from UM1 this run
+roundtripseconds = 0.0                                                          # Seconds spent in whole UM1 round trips this run, summed over batches. Not a stage, since it covers serialize, network, decode and cache
+cachehits = 0                                                                   # Unique strings whose moniforms were found in the cache
+cachemisses = 0                                                                 # Unique strings we had to send to UM1
+cacheduplicates = 0                                                             # Strings that were repeats of other strings in the same payload and so were not sent again
 
-def understand(payload, options):
+@contextmanager
+def timed(stage):                                                               # Add the time spent in the with-block to stage in stageseconds
+    start = time.perf_counter()
     try:
-        response = requests.post(um1service, json.dumps({'payload':payload, 'options':options}))    # Send payload and Understanding options to UM-1 server
-        if response:
+        yield
+    finally:
+        if telemetry: addtelemetry(stage, time.perf_counter() - start)
+
+def addtelemetry(stage=None, seconds=0, latency=None, servicems=None, sent=0, received=0, roundtrip=0):
+    global bytessent, bytesreceived, chunklatencytotal, chunkservicetotal, roundtripseconds
+    with telemetrylock:
+        roundtripseconds += roundtrip
+        if stage: stageseconds[stage] = stageseconds.get(stage, 0) + seconds
+        if latency is not None: chunklatencies.append(latency); chunklatencytotal += latency
+        if servicems is not None: chunkservicems.append(servicems); chunkservicetotal += servicems
+        bytessent += sent; bytesreceived += received
+
+def resettelemetry():
+    global bytessent, bytesreceived, chunklatencytotal, chunkservicetotal, roundtripseconds
+    stageseconds.clear(); chunklatencies.clear(); chunkservicems.clear()
+    bytessent = 0; bytesreceived = 0; chunklatencytotal = 0.0; chunkservicetotal = 0.0; roundtripseconds = 0.0
+
+def countbytes(chunks):                                                         # Pass byte chunks through, counting them as received
+    for chunk in chunks:
+        if telemetry: addtelemetry(received=len(chunk))
+        yield chunk
+
+def percentiles(values, scale=1):                                               # Latency histogram summary: count, mean, p50, p95, p99 and max (nearest rank), each multiplied by scale
+    if not values: return {"count": 0}
+    ordered = sorted(values)
+    rank = lambda fraction: ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {"count": len(ordered), "mean": round(scale * sum(ordered) / len(ordered), 2), "p50": round(scale * rank(0.50), 2), "p95": round(scale * rank(0.95), 2),
+            "p99": round(scale * rank(0.99), 2), "max": round(scale * ordered[-1], 2)}
+
+def getsession():                                                               # Return the shared requests.Session, creating it with a connection pool large enough for maxconnections concurrent chunks
+    global session
+    if session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=maxconnections)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+    return session
+
+def understandchunk(payload, options):                                          # Send one chunk of test cases to UM1, retrying with exponential backoff on communications, parse and server (5xx) failures
+    started = time.perf_counter()
+    with timed("serialize"):
+        body = json.dumps({'payload':payload, 'options':options}).encode("utf-8")
+    for attempt in range(maxretries + 1):
+        if attempt:
+            delay = retrybackoff * 2 ** (attempt - 1)
+            print(f"UM-1 retrying chunk of {len(payload)} test cases in {delay} s (attempt {attempt + 1} of {maxretries + 1})")
+            time.sleep(delay)
+        try:
+            with timed("network"):                                              # With incrementaldecode the body is read while decoding, so network time then covers only sending and the response headers
+                response = getsession().post(um1service, data=body, timeout=requesttimeout, stream=incrementaldecode)    # Send payload and Understanding options to UM-1 server
+            if telemetry: addtelemetry(sent=len(body), received=0 if incrementaldecode else len(response.content))
+            if response:
+                try:
+                    with timed("decode"):
+                        if incrementaldecode:
+                            understanding = decodeunderstanding(countbytes(response.iter_content(chunk_size=65536)))   # Parse body as it arrives, never holding all of it as text
+                        else:
+                            understanding = response.json()                     # Parse returned string as JSONObject to return it as a python dict
+                except Exception as err:
+                    print(f"UM-1 understanding exception: {err} -- Response:{response}")  # Exception parsing result JSON, typically a truncated response. Worth a retry
+                    continue
+                if understanding is not None:                                   # Response parsing succeeded. responsed was received as a JSONObject and was parsed into "understanding" (most often used name) which is a python dict
+                    if logtraffic:print(f"\npayload='{payload}'\nResult: {json.dumps(understanding, default=list)}")
+                    error = understanding.get('error')                          # Check if there is an error message added by UM1 server or UM1 itself
+                    if error:
+                        print(f"UM-1 error: {error}")                           # If so, print it here so we won't miss it even if caller is not doing proper error checking
+                    if telemetry: addtelemetry(latency=time.perf_counter() - started, servicems=understanding.get("ms"))
+                    return understanding                                        # In any case, error message or not, return entire JSON to caller. UM1 errors are not retried
+                else:
+                    print("Response form UM1 is not in valid JSON format")      # Non-exception JSON parse nevertheless did not return a valid result. We expect a python dict of meta-information at this level
+            else:
+                print(f"NO response from UM-1 -- Status: {response.status_code}") # Non-exception no-response from UM1 -- Typically, we received no JSON to parse.
+                if response.status_code < 500 and response.status_code not in (408, 429):
+                    return None                                                 # Other 4xx such as 400 bad request will fail the same way again. Only server errors, timeouts and throttling are worth a retry
+        except Exception as ex:
+            print(f"UM-1 communications exception: {ex}")                       # Serious server side or communications error (such as UM1 restart or network disconnect)
+    return None
+
+def compactmoniforms(node):                                                     # Replace each innermost list of ints in a (possibly deep) nested moniform structure with a compact array of 32 bit ints (64 bit if needed)
+    if not isinstance(node, list): return node
+    if not node or isinstance(node[0], int):
+        try:
+            return array('i', node)
+        except OverflowError:
+            return array('q', node)
+    return [compactmoniforms(child) for child in node]
+
+def decodeunderstanding(chunks):                                                # Incrementally decode a UM1 response body given as an iterable of byte chunks. The "moniform" array is decoded one test case at a time,
+    decoder = json.JSONDecoder()                                                # each turned into compact arrays right away, so we never hold the whole body as text or all moniforms as lists of python ints.
+    utf8 = codecs.getincrementaldecoder("utf-8")()                              # All other fields (ms, competenceuuid, totalticks...) are small and decoded as usual
+    chunks = iter(chunks)
+    buffer = ""; position = 0; eof = False
+
+    def fill():                                                                 # Append next chunk to buffer, dropping the part we have already decoded
+        nonlocal buffer, position, eof
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buffer = buffer[position:] + utf8.decode(b"", final=True)
+        else:
+            buffer = buffer[position:] + utf8.decode(chunk)
+        position = 0
+
+    def peek():                                                                 # Skip whitespace and return next character, reading more as needed. "" means end of body
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n": position += 1
+            if position < len(buffer) or eof: return buffer[position:position + 1]
+            fill()
+
+    def value():                                                                # Decode one complete JSON value at position, reading more until it is complete
+        nonlocal position
+        peek()
+        while True:
             try:
-                understanding = response.json()                                 # Parse returned string as JSONObject to return it as a python dict
-            except Exception as err:
-                print(f"UM-1 understanding exception: {err} -- Response:{response}")  # Exception parsing result JSON. No more information available
-                return {"error": err}
-            if understanding is not None:                                       # Response parsing succeeded. responsed was received as a JSONObject and was parsed into "understanding" (most often used name) which is a python dict
-                if logtraffic:print(f"\npayload='{payload}'\nResult: {json.dumps(understanding)}")
-                error = understanding.get('error')                              # Check if there is an error message added by UM1 server or UM1 itself
-                if error:
-                    print(f"UM-1 error: {error}")                               # If so, print it here so we won't miss it even if caller is not doing proper error checking
-                return understanding                                            # In any case, error message or not, return entire JSON to caller
+                result, end = decoder.raw_decode(buffer, position)
+                if eof or type(result) not in (int, float) or buffer[end:].strip("0123456789+-.eE"):   # A number followed only by number characters, or by nothing,
+                    position = end                                              # might continue in the next chunk, as in '1.' + '5'
+                    return result
+            except json.JSONDecodeError:
+                if eof: raise
+            fill()
+
+    def expect(characters):                                                     # Consume next character, which must be one of characters
+        nonlocal position
+        character = peek()
+        if not character or character not in characters: raise ValueError(f"UM1 response: expected one of '{characters}' at '{buffer[position:position + 40]}'")
+        position += 1
+        return character
+
+    understanding = {}
+    expect("{")
+    if peek() == "}": return understanding
+    while True:
+        key = value()
+        expect(":")
+        if key == "moniform" and peek() == "[":
+            expect("[")
+            testcases = []
+            if peek() != "]":
+                while True:
+                    testcases.append(compactmoniforms(value()))                 # One test case: a list of (typically six) moniforms
+                    if expect(",]") == "]": break
             else:
-                print("Response form UM1 is not in valid JSON format")          # Non-exception JSON parse nevertheless did not return a valid result. We expect a python dict of meta-information at this level
+                expect("]")
+            understanding[key] = testcases
         else:
-            print("NO response from UM-1")                                      # Non-exception no-response from UM1 -- Typically, we received no JSON to parse.
-    except Exception as ex:
-        print(f"UM-1 communications exception: {ex}")                           # Serious server side or communications error (such as UM1 restart or network disconnect)
-    return None
+            understanding[key] = value()
+        if expect(",}") == "}": return understanding
 
-def createpayload():                                                            # Create a list of testcases which are lists of target and alternatives which are each lists of numbers representing the Understanding of each
-    global numberunderstandings, testfileproblems, truths, totaltestchars
-    payload = []; testfileproblems = 0; totaltestchars = 0                      # Construct and return a payload based on test file contents. testfileproblems counts syntax errors in test file.
+def understand(payload, options):                                               # Split payload into chunks of chunksize test cases, send up to maxconnections of them at a time and reassemble the moniforms in payload order
+    if not chunksize or len(payload) <= chunksize:
+        return understandchunk(payload, options)
+    chunks = [payload[start:start + chunksize] for start in range(0, len(payload), chunksize)]
+    with ThreadPoolExecutor(max_workers=maxconnections) as pool:
+        results = list(pool.map(lambda chunk: understandchunk(chunk, options), chunks))   # map() returns results in chunk order regardless of completion order
+    understanding = None
+    moniforms = []
+    servicems = 0
+    for chunk, result in zip(chunks, results):
+        chunkmoniforms = result.get("moniform") if result else None
+        if not chunkmoniforms or result.get("error"):
+            print(f"UM-1 gave no understanding for a chunk of {len(chunk)} test cases. They will be counted as understanding failures")
+            chunkmoniforms = []
+        elif len(chunkmoniforms) != len(chunk):
+            print(f"UM-1 returned {len(chunkmoniforms)} moniforms for a chunk of {len(chunk)} test cases")
+            chunkmoniforms = chunkmoniforms[:len(chunk)]
+        elif understanding is None:
+            understanding = dict(result)                                        # Metadata (competenceuuid, uptimesecs etc.) is taken from the first successful chunk
+        moniforms.extend(chunkmoniforms)
+        moniforms.extend([[]] * (len(chunk) - len(chunkmoniforms)))             # Pad failed or short chunks with empty test cases so indexes still line up with payload
+        if result and result.get("ms"): servicems += result.get("ms")           # Service time is the sum of the service times of all chunks
+    if understanding is None:                                                   # No chunk was fully understood. Return the first error, never one chunk's result as if it covered the whole payload
+        errors = [result.get("error") or "UM-1 gave no complete understanding for any chunk" for result in results if result]
+        return {"error": errors[0]} if errors else None
+    understanding["moniform"] = moniforms
+    understanding["ms"] = servicems
+    return understanding
+
+def opencache():                                                                # Open (and if needed create) the moniform cache. Opening is constant time regardless of cache size
+    global cache
+    if cache is None:
+        cache = sqlite3.connect(cachepath, check_same_thread=False)
+        cache.execute("PRAGMA journal_mode=WAL")
+        cache.execute("PRAGMA synchronous=NORMAL")
+        cache.execute("CREATE TABLE IF NOT EXISTS moniforms (key BLOB PRIMARY KEY, moniform BLOB NOT NULL, used INTEGER NOT NULL) WITHOUT ROWID")
+        cache.execute("CREATE INDEX IF NOT EXISTS moniformsused ON moniforms (used)")
+        cache.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        cache.commit()
+    return cache
+
+def getcachemeta(name, default=None):
+    row = opencache().execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else default
+
+def setcachemeta(name, value):
+    opencache().execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, str(value)))
+
+def cachekey(text, optionskey, competenceuuid):                                 # Content address of one understanding: hash of text, options and competence together
+    return hashlib.sha1(f"{competenceuuid}\0{optionskey}\0{text}".encode("utf-8")).digest()
+
+def lookupcache(texts, optionskey, competenceuuid, tick):                       # Return dict of text -> moniform for the texts that are in the cache and mark them as used in this run
+    found = {}
+    db = opencache()
+    for start in range(0, len(texts), 500):                                     # Stay well below SQLite's limit on host parameters per statement
+        keys = {cachekey(text, optionskey, competenceuuid): text for text in texts[start:start + 500]}
+        rows = db.execute(f"SELECT key, moniform FROM moniforms WHERE key IN ({','.join('?' * len(keys))})", list(keys)).fetchall()
+        for key, blob in rows:
+            found[keys[key]] = array('q', blob).tolist()
+        db.executemany("UPDATE moniforms SET used = ? WHERE key = ?", [(tick, key) for key, blob in rows])
+    return found
+
+def storecache(understood, optionskey, competenceuuid, tick):                   # Add dict of text -> moniform to the cache, then evict least recently used entries if we grew too large
+    db = opencache()
+    db.executemany("INSERT OR REPLACE INTO moniforms (key, moniform, used) VALUES (?, ?, ?)",
+                   [(cachekey(text, optionskey, competenceuuid), array('q', moniform).tobytes(), tick) for text, moniform in understood.items() if moniform])
+    if cachemaxentries:
+        excess = db.execute("SELECT count(*) FROM moniforms").fetchone()[0] - cachemaxentries
+        if excess > 0:
+            db.execute("DELETE FROM moniforms WHERE key IN (SELECT key FROM moniforms ORDER BY used LIMIT ?)", (excess,))
+
+def collectstrings(node, texts):                                                # Add all strings in a (possibly deep) nested payload to dict texts, in order of first appearance. Returns number of strings seen
+    if isinstance(node, str):
+        texts[node] = None
+        return 1
+    return sum(collectstrings(child, texts) for child in node)
+
+def fillmoniforms(node, understood):                                            # Rebuild the nested moniform structure matching the nested payload from dict of text -> moniform
+    if isinstance(node, str):
+        return understood.get(node, [])
+    return [fillmoniforms(child, understood) for child in node]
+
+def resetcachestats():                                                         # Cache counters are per run
+    global cachehits, cachemisses, cacheduplicates
+    cachehits = 0; cachemisses = 0; cacheduplicates = 0
+
+def understandcached(payload, options):                                         # Like understand(), but each unique string is sent at most once, and only if it is not already in the cache
+    global cachehits, cachemisses, cacheduplicates
+    texts = {}
+    duplicates = collectstrings(payload, texts) - len(texts)
+    texts = list(texts)
+    optionskey = json.dumps(options, sort_keys=True)
+    with cachelock, timed("cache"):
+        tick = int(getcachemeta("tick", 0)) + 1                                 # Run counter used as the "last used" stamp for eviction
+        competenceuuid = getcachemeta("competenceuuid")                         # Competence of the server as of our previous run
+        found = lookupcache(texts, optionskey, competenceuuid, tick) if competenceuuid else {}
+    sent = [text for text in texts if text not in found] or texts[:1]           # If everything is cached we still send one string, to learn the current competenceuuid and server metadata
+    understanding = understand(sent, options)                                   # A flat list of strings is a valid payload. Moniforms come back in the same order
+    if not understanding or understanding.get("error") or not understanding.get("moniform"):
+        return understanding
+    understood = dict(zip(sent, understanding["moniform"]))
+    if understanding.get("competenceuuid") != competenceuuid:                   # Server has a new competence since the cache was filled, so cached moniforms are no longer valid for it
+        stale = [text for text in texts if text not in understood]
+        if stale:
+            more = understand(stale, options)
+            if not more or more.get("error") or not more.get("moniform"):
+                return more
+            understood.update(zip(stale, more["moniform"]))
+            understanding["ms"] = (understanding.get("ms") or 0) + (more.get("ms") or 0)
+        found = {}
+        competenceuuid = understanding.get("competenceuuid")
+    with cachelock, timed("cache"):
+        setcachemeta("competenceuuid", competenceuuid)
+        cachehits += len(found)
+        cachemisses += len(texts) - len(found)
+        cacheduplicates += duplicates
+        storecache(understood, optionskey, competenceuuid, tick)
+        setcachemeta("tick", tick)
+        opencache().commit()
+    understood.update(found)
+    understanding["moniform"] = fillmoniforms(payload, understood)
+    return understanding
+
+def readtests():                                                                # Generator over the test file. Yields (truth, strings, line) for each well formed test line, counting problems and characters as it goes
+    global numberunderstandings, testfileproblems, totaltestchars
+    testfileproblems = 0; totaltestchars = 0; testcount = 0                     # testfileproblems counts syntax errors in test file
     with open(testpath) as testfile:
-        for lineno, line in enumerate(testfile):                                # We read entire file
+        for lineno, line in enumerate(testfile):                                # We read the file one line at a time and never hold more of it than the caller asks for
             if len(line) < 6 or line.startswith('#'): continue                  # We allow comment lines and (nearly) empty lines. They add to line numbers in lineno but not to testcount
-            line = line.rstrip()
-            alllines.append(line)                                               # Save line, slightly sanitized, in alllines
+            line = line.rstrip()                                                # Line, slightly sanitized, is passed along for the failure file
             parts = line.split("\t")                                            # Separate the tab-separated fields
             if len(parts) < 4:                                                  # We need at least truth, target, and two test cases per test/line (that is why "4") but will happily handle any number of test cases beyond that.
                 if lineno < 10: continue                                        # Quietly ignore header lines until we get a bit into the file
                 testfileproblems += 1                                           # After those, all lines better have well formatted data in them or we treat it as an error
                 continue                                                        # and then we soldier on
-            truths.append(int(parts[0]))                                        # Keep truths here. Do not send them to backend because it does not need to know :-) 
-            payload.append(parts[1:])                                           # Append the rest of the strings in the testcase (a list of target string and two or more (5 in this case) strings to compare with) to payload list of testcases
             for p in parts[1:]: totaltestchars += len(p)                        # totaltestchars is total numbers of characters in payload
             numberunderstandings += len(parts) - 1                              # Truth is only thing we don't evaluate. We HOPE these are all strings. The count will be off if they are not. This should be counted in backend and returned
-            if maxtestlines and maxtestlines <= len(payload): break             # Allow limiting to only a few lines of test cases if so desired.
+            testcount += 1
+            yield int(parts[0]), parts[1:], line                                # Truth is kept by caller. Do not send it to backend because it does not need to know :-)
+            if maxtestlines and maxtestlines <= testcount: break                # Allow limiting to only a few lines of test cases if so desired.
+
+def readbatches(size):                                                          # Generator grouping readtests() into batches of at most size tests. Each batch is a tuple of (payload, truths, lines)
+    batchpayload = []; batchtruths = []; batchlines = []
+    started = time.perf_counter()
+    for truth, strings, line in readtests():
+        batchtruths.append(truth); batchpayload.append(strings); batchlines.append(line)
+        if len(batchpayload) >= size:
+            if telemetry: addtelemetry("parse", time.perf_counter() - started) # Time between yields is time spent reading and parsing the test file
+            yield batchpayload, batchtruths, batchlines
+            batchpayload = []; batchtruths = []; batchlines = []
+            started = time.perf_counter()
+    if telemetry: addtelemetry("parse", time.perf_counter() - started)
+    if batchpayload:
+        yield batchpayload, batchtruths, batchlines
+
+def createpayload():                                                            # Create a list of testcases which are lists of target and alternatives which are each lists of numbers representing the Understanding of each
+    global truths, alllines
+    payload = []; truths = []; alllines = []                                    # Construct and return a payload based on entire test file contents. Truths and lines go to globals
+    with timed("parse"):
+        for truth, strings, line in readtests():
+            truths.append(truth)                                                # Keep truths here
+            payload.append(strings)                                             # Append the strings in the testcase (a list of target string and two or more (5 in this case) strings to compare with) to payload list of testcases
+            alllines.append(line)                                               # Save line in alllines
     return payload
 
-def classifyunderstandings(understandings, of):                                 # understandings is a JSONObject -- it has a few fields of returned metadata, and the result itself is in the field "moniform"
-    global testsdone, testfileproblems
-    sumofsetsizes = 0; nosemantics = 0; ambiguouscount = 0; correct = 0; incorrect = 0; testsdone = 0; sumofcertainties = 0; certaintiescount = 0; 
-    candidatemoniformcount = 0; targetmoniformcount = 0; sumofintersections = 0; sumofunions = 0; emptyintersections = 0; failures = 0
+def understandroundtrip(payload, options):                                      # understandcached() or understand() as usecache says, adding the whole round trip to roundtripseconds
+    started = time.perf_counter()
+    try:
+        return understandcached(payload, options) if usecache else understand(payload, options)
+    finally:
+        if telemetry: addtelemetry(roundtrip=time.perf_counter() - started)
+
+def understandbatches(options):                                                 # Generator streaming the test file through UM1. Yields (payload, truths, lines, understandings) per batch, in file order,
+    with ThreadPoolExecutor(max_workers=maxbatchesinflight) as pool:            # with up to maxbatchesinflight batches being understood while the caller scores the oldest one. Memory use is bounded by batch size
+        inflight = deque()
+        for batchpayload, batchtruths, batchlines in readbatches(streambatchsize):
+            inflight.append((batchpayload, batchtruths, batchlines, pool.submit(understandroundtrip, batchpayload, options)))
+            if len(inflight) >= maxbatchesinflight:
+                batchpayload, batchtruths, batchlines, future = inflight.popleft()
+                with timed("wait"):                                             # Time the scorer sits idle waiting for UM1
+                    understandings = future.result()
+                yield batchpayload, batchtruths, batchlines, understandings
+        while inflight:
+            batchpayload, batchtruths, batchlines, future = inflight.popleft()
+            with timed("wait"):
+                understandings = future.result()
+            yield batchpayload, batchtruths, batchlines, understandings
+
+def pickwinner(scores):                                                         # Decide a test case from its list of candidate jaccard scores, None where a candidate had no moniform.
+    winnerindex = -1; winnerscore = -1; runnerupscore = -1; ambiguous = 0     # Returns (winner index, winner score, runner-up score, number of candidates tied with the winner)
+    for i, jaccardscore in enumerate(scores):
+        if jaccardscore is None: continue
+        if winnerscore == jaccardscore:                                         # Tied top score
+            runnerupscore = jaccardscore
+            ambiguous += 1                                                      # Mark this as ambiguous
+        if winnerscore < jaccardscore:                                          # New winner
+            runnerupscore = winnerscore                                         # Previous winner becomes the runner-up
+            winnerscore = jaccardscore
+            winnerindex = i
+            ambiguous = 0                                                       # If we have a clear winner, then we are not ambiguous
+        elif runnerupscore < jaccardscore:                                      # We must handle the case where the new score beats the runner up score but not the winner score
+            runnerupscore = jaccardscore
+    return winnerindex, winnerscore, runnerupscore, ambiguous
+
+def scoretestcases(testcases):                                                  # Batch Jaccard scoring engine. Scores every target/candidate pair of every test case in one pass, separate from any printing
+    if usenumpy and numpy is not None:                                          # Results are returned as columns (lists indexed by test index) plus batch-wide totals
+        scores = scorenumpy(testcases)
+        if scores is not None: return scores
+    return scoreloop(testcases)
+
+def scoreloop(testcases):                                                       # Scoring engine for when NumPy is not available: one python set per target, one intersection per candidate
+    numbertests = len(testcases)
+    valid = [False] * numbertests                                               # True for test cases that had a target and at least two candidates to decide between
+    winners = [-1] * numbertests                                                # Index of winning candidate, -1 if there was no winner
+    winnerscores = [-1] * numbertests
+    runnerupscores = [-1] * numbertests
+    certainties = [0] * numbertests                                             # Margin between winner and runner-up for this test case
+    ambiguities = [0] * numbertests                                             # Number of candidates that tied with the winner
+    emptycounts = [0] * numbertests                                             # Number of candidates with an empty intersection with the target
+    jaccards = [None] * numbertests                                             # List of jaccard scores per candidate, None where the candidate had no moniform
+    sumofsetsizes = 0; sumofintersections = 0; sumofunions = 0; failures = 0; candidatemoniformcount = 0; targetmoniformcount = 0
+
+    for testindex, testcase in enumerate(testcases):                            # A testcase is a list of (typically six) moniforms (lists of numbers), where first is the target
+        if not testcase or len(testcase) < 3:                                   # Required: a target and at least two candidates to decide between
+            failures += 1
+            continue
+        valid[testindex] = True
+        targetmoniform = testcase[0]                                            # Understanding of target, as the simplest kind of moniform, a list of integers without duplicates, sorted by declining salience estimates
+        if not targetmoniform: continue
+        targetmoniformcount += 1
+        candidatemoniformcount += len(testcase) - 1
+        targetset = set(targetmoniform)                                         # Target set is built once per test case and reused for all candidates
+        targetlen = len(targetset)
+        sumofsetsizes += targetlen
+        empty = 0
+        scores = []
+        for i in range(1, len(testcase)):
+            candmoniform = testcase[i]
+            if not candmoniform:
+                failures += 1
+                scores.append(None)
+                continue
+            candlen = len(set(candmoniform))
+            intersectionlen = len(targetset.intersection(candmoniform))         # Intersection of target moniform and candidate moniform
+            unionlen = targetlen + candlen - intersectionlen                    # Size of union follows from the sizes of the sets and their intersection so we never build the union set
+            jaccardscore = intersectionlen / unionlen                           # Compute jaccard distance from target moniform to this candidate moniform
+            scores.append(jaccardscore)
+            sumofsetsizes += candlen; sumofintersections += intersectionlen; sumofunions += unionlen
+            if intersectionlen == 0: empty += 1
+        winnerindex, winnerscore, runnerupscore, ambiguous = pickwinner(scores)
+        winners[testindex] = winnerindex; winnerscores[testindex] = winnerscore; runnerupscores[testindex] = runnerupscore
+        ambiguities[testindex] = ambiguous; emptycounts[testindex] = empty; jaccards[testindex] = scores
+        if runnerupscore > -1 and winnerscore > -1:
+            certainties[testindex] = winnerscore - runnerupscore                # "margin" statistic tells us the margin between the winner and the runner-up which is a measure of our certainty of the answer
+
+    return {"valid": valid, "winner": winners, "winnerscore": winnerscores, "runnerupscore": runnerupscores, "certainty": certainties, "ambiguous": ambiguities,
+            "emptyintersections": emptycounts, "jaccard": jaccards, "sumofsetsizes": sumofsetsizes, "sumofintersections": sumofintersections, "sumofunions": sumofunions,
+            "failures": failures, "targetmoniformcount": targetmoniformcount, "candidatemoniformcount": candidatemoniformcount}
 
+def scorenumpy(testcases):                                                      # Same result as scoreloop(testcases), with the set arithmetic of the whole batch done in bulk. All moniforms are packed into one flat array
+    numbertests = len(testcases)                                                # of keys (test, concept, position of moniform in test) and sorted once. Repeats within a moniform are then adjacent, and a candidate concept
+    valid = [bool(testcase) and len(testcase) >= 3 for testcase in testcases]   # is shared with the target exactly when its run of equal (test, concept) starts with a target key, position 0 sorting first.
+    scored = [testindex for testindex in range(numbertests) if valid[testindex] and testcases[testindex][0]]   # Test cases with a target moniform. The rest get the same defaults as in scoreloop
+    winners = [-1] * numbertests; winnerscores = [-1] * numbertests; runnerupscores = [-1] * numbertests; certainties = [0] * numbertests
+    ambiguities = [0] * numbertests; emptycounts = [0] * numbertests; jaccards = [None] * numbertests
+    failures = valid.count(False)
+    totals = {"sumofsetsizes": 0, "sumofintersections": 0, "sumofunions": 0, "targetmoniformcount": len(scored), "candidatemoniformcount": 0}
+    if scored:                                                                  # Returns None, to fall back to scoreloop, if the keys would not fit in 64 bits
+        moniforms = [moniform if moniform else () for testindex in scored for moniform in testcases[testindex]]
+        moniformcounts = numpy.array([len(testcases[testindex]) for testindex in scored], dtype=numpy.int64)   # Target and candidates of each scored test case
+        lengths = numpy.fromiter(map(len, moniforms), dtype=numpy.int64, count=len(moniforms))
+        nonempty = [moniform for moniform in moniforms if len(moniform)]
+        try:
+            typecodes = set(map(attrgetter("typecode"), nonempty))              # Only arrays have typecodes
+        except AttributeError:
+            typecodes = None
+        if typecodes and len(typecodes) == 1:                                   # Arrays from incrementaldecode are copied as raw bytes
+            values = numpy.frombuffer(b"".join(map(array.tobytes, nonempty)), dtype=typecodes.pop()).astype(numpy.int64)
+        else:
+            values = numpy.fromiter(chain.from_iterable(moniforms), dtype=numpy.int64, count=int(lengths.sum()))
+        numbermoniforms = len(moniforms)
+        firstmoniforms = numpy.zeros(len(scored), dtype=numpy.int64); numpy.cumsum(moniformcounts[:-1], out=firstmoniforms[1:])   # Moniform number of each target
+        moniformtests = numpy.repeat(numpy.arange(len(scored), dtype=numpy.int64), moniformcounts)
+        moniformpositions = numpy.arange(numbermoniforms, dtype=numpy.int64) - firstmoniforms[moniformtests]   # 0 for targets, 1.. for candidates
+        lowest = int(values.min())
+        conceptbits = (int(values.max()) - lowest).bit_length(); positionbits = (int(moniformcounts.max()) - 1).bit_length()   # Keys are bit fields, so taking them apart is shifts and masks
+        if len(scored).bit_length() + conceptbits + positionbits > 63: return None
+        keys = numpy.repeat((moniformtests << (conceptbits + positionbits)) | moniformpositions, lengths) | ((values - lowest) << positionbits)
+        keys.sort()
+        positionmask = (1 << positionbits) - 1
+        repeats = keys[1:] == keys[:-1]
+        if repeats.any():                                                       # Drop repeated concepts so each moniform is a set. UM1 moniforms normally have none
+            keys = keys[numpy.concatenate(([True], ~repeats))]
+            setsizes = numpy.bincount(firstmoniforms[keys >> (conceptbits + positionbits)] + (keys & positionmask), minlength=numbermoniforms)
+        else:
+            setsizes = lengths
+        concepts = keys >> positionbits                                         # (test, concept)
+        runstarts = numpy.ones(len(keys), dtype=bool)
+        runstarts[1:] = concepts[1:] != concepts[:-1]
+        positions = keys & positionmask
+        hastarget = positions[runstarts] == 0                                   # Per run of equal (test, concept): does the target have it
+        sharedkeys = keys[(positions > 0) & hastarget[numpy.cumsum(runstarts) - 1]]
+        intersections = numpy.bincount(firstmoniforms[sharedkeys >> (conceptbits + positionbits)] + (sharedkeys & positionmask), minlength=numbermoniforms)
+        candidates = numpy.flatnonzero(moniformpositions > 0)                   # Candidate moniform numbers, grouped by test case in order
+        present = lengths[candidates] > 0                                       # Candidates that have a moniform
+        candidatelens = setsizes[candidates]; intersectionlens = intersections[candidates]
+        unionlens = setsizes[firstmoniforms][moniformtests[candidates]] + candidatelens - intersectionlens
+        scores = numpy.where(present, intersectionlens / numpy.maximum(unionlens, 1), -2.0)   # -2 marks a missing moniform and never wins
+        starts = firstmoniforms - numpy.arange(len(scored))                     # Index of first candidate of each test case among candidates
+        counts = moniformcounts - 1
+        best = numpy.maximum.reduceat(scores, starts)
+        isbest = scores == numpy.repeat(best, counts)
+        bestcounts = numpy.add.reduceat(isbest, starts)
+        bestindexes = numpy.flatnonzero(isbest)
+        firstbest = bestindexes[numpy.searchsorted(bestindexes, starts)] - starts   # Ties go to the first candidate, as in scoreloop
+        secondbest = numpy.maximum.reduceat(numpy.where(isbest, -2.0, scores), starts)
+        runnerup = numpy.where(bestcounts > 1, best, secondbest)
+        emptys = numpy.add.reduceat(present & (intersectionlens == 0), starts)
+        flatjaccards = [score if isthere else None for score, isthere in zip(scores.tolist(), present.tolist())]
+        for testindex, start, count, bestscore, bestcount, winner, runnerupscore, empty in zip(scored, starts.tolist(), counts.tolist(), best.tolist(),
+                                                                                              bestcounts.tolist(), firstbest.tolist(), runnerup.tolist(), emptys.tolist()):
+            jaccards[testindex] = flatjaccards[start:start + count]
+            emptycounts[testindex] = empty
+            if bestscore < 0: continue                                          # No candidate had a moniform
+            winners[testindex] = winner; winnerscores[testindex] = bestscore; ambiguities[testindex] = bestcount - 1
+            if runnerupscore >= 0:
+                runnerupscores[testindex] = runnerupscore
+                certainties[testindex] = bestscore - runnerupscore
+        failures += int((~present).sum())
+        totals["candidatemoniformcount"] = int(counts.sum())
+        totals["sumofsetsizes"] = int(setsizes.sum())
+        totals["sumofintersections"] = int(intersectionlens.sum())
+        totals["sumofunions"] = int(unionlens[present].sum())
+    return {"valid": valid, "winner": winners, "winnerscore": winnerscores, "runnerupscore": runnerupscores, "certainty": certainties, "ambiguous": ambiguities,
+            "emptyintersections": emptycounts, "jaccard": jaccards, **totals, "failures": failures}
+
+def scoresharedrange(name, numbertests, numbermoniforms, typecode, start, end): # Runs in a scoring worker: score test cases start..end of the batch in shared memory block name. Only the range and the results are pickled
+    global workermemory
+    if workermemory is None or workermemory.name != name:
+        if workermemory is not None: workermemory.close()
+        workermemory = shared_memory.SharedMemory(name=name)                    # Main process owns the block and unlinks it when the batch is scored
+    header = numbertests + numbermoniforms + 2                                  # Layout: int64 test case offsets, int64 moniform offsets, then all concept ids back to back as typecode
+    offsets = workermemory.buf[:8 * header].cast('q')
+    values = workermemory.buf[8 * header:].cast(typecode)
+    testoffsets = offsets[start:end + 1].tolist()                               # Index of first moniform of each test case in our range
+    moniformoffsets = offsets[numbertests + 1 + testoffsets[0]:numbertests + 2 + testoffsets[-1]].tolist()  # Index of first concept id of each moniform in our range
+    firstmoniform = testoffsets[0]; firstvalue = moniformoffsets[0]
+    concepts = values[firstvalue:moniformoffsets[-1]].tolist()                  # One conversion for the whole range
+    offsets.release(); values.release()
+    gc.disable()                                                                # Nothing here makes reference cycles, and collections triggered by building hundreds of thousands of lists would double the cost
+    try:
+        testcases = [[concepts[moniformoffsets[moniform] - firstvalue:moniformoffsets[moniform + 1] - firstvalue] for moniform in range(testoffsets[test] - firstmoniform, testoffsets[test + 1] - firstmoniform)]
+                     for test in range(end - start)]
+        return scoretestcases(testcases)
+    finally:
+        gc.enable()
+
+def mergescores(parts):                                                         # Concatenate per-test columns and add up batch totals of partial results from scoretestcases, in order
+    scores = {}
+    for part in parts:
+        for name, value in part.items():
+            if name in scores:
+                scores[name] += value                                           # Lists are concatenated, counters are added
+            else:
+                scores[name] = value
+    return scores
+
+def scoreparallel(testcases):                                                   # Same result as scoretestcases(testcases), computed by a pool of processes reading the moniforms from one shared memory block
+    global scoringpool
+    processes = scoringprocesses or os.cpu_count()
+    if scoringpool is None:
+        startmethod = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"   # Never fork: when streaming, transport threads are running and a forked child can inherit a lock one of them holds
+        scoringpool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context(startmethod))
+    numbertests = len(testcases)
+    testoffsets = array('q', [0]); testoffsets.extend(accumulate(len(testcase) if testcase else 0 for testcase in testcases))
+    moniformoffsets = array('q', [0]); moniformoffsets.extend(accumulate(len(moniform) if moniform else 0 for testcase in testcases if testcase for moniform in testcase))
+    numbermoniforms = len(moniformoffsets) - 1
+    header = numbertests + numbermoniforms + 2
+    typecodes = {moniform.typecode if isinstance(moniform, array) else None for testcase in testcases if testcase for moniform in testcase if moniform}
+    rawcopy = len(typecodes) == 1 and None not in typecodes                    # Moniforms from incrementaldecode are arrays already and are copied as raw bytes. Lists are converted to int64
+    typecode = next(iter(typecodes)) if rawcopy else 'q'
+    itemsize = array(typecode).itemsize
+    memory = shared_memory.SharedMemory(create=True, size=8 * header + itemsize * moniformoffsets[-1] + 8)
+    try:
+        memory.buf[:8 * header] = testoffsets.tobytes() + moniformoffsets.tobytes()
+        step = max(1, -(-numbertests // (4 * processes)))                       # A few ranges per process so a slow range does not hold up the others
+        futures = []
+        for start in range(0, numbertests, step):                               # Copy concept ids into shared memory one range at a time and start scoring each range as soon as it is there
+            end = min(start + step, numbertests)
+            moniforms = [moniform for testcase in testcases[start:end] if testcase for moniform in testcase if moniform]
+            if rawcopy:
+                data = b"".join([moniform.tobytes() for moniform in moniforms])
+            else:
+                data = array('q', [concept for moniform in moniforms for concept in moniform]).tobytes()
+            position = 8 * header + itemsize * moniformoffsets[testoffsets[start]]
+            memory.buf[position:position + len(data)] = data
+            futures.append(scoringpool.submit(scoresharedrange, memory.name, numbertests, numbermoniforms, typecode, start, end))
+        return mergescores(future.result() for future in futures)               # Results are merged in test case order, so the outcome is the same as a serial run
+    finally:
+        memory.close()
+        memory.unlink()
+
+def firstpositions(moniform):                                                  # Concept id -> position of its first occurrence in moniform. The prefix of length n holds exactly the concepts at positions below n
+    positions = dict(zip(moniform, range(len(moniform))))                       # Moniforms normally have no duplicates, and then this is all we need
+    if len(positions) < len(moniform):
+        positions = dict(zip(reversed(moniform), range(len(moniform) - 1, -1, -1)))   # Later assignments win, so going backwards leaves first occurrences
+    return positions
+
+def scoreprefixes(testcases, topns):                                            # Score test cases as scoretestcases would if UM1 had returned only the first topn concepts of each moniform, for every topn in topns.
+    topns = sorted(set(topns))                                                  # Moniforms are in declining salience order, so a smaller topn is a prefix. Each target/candidate pair is visited once: a shared
+    columns = {topn: {"valid": [], "winner": [], "winnerscore": [], "runnerupscore": [], "certainty": [], "ambiguous": [], "emptyintersections": [], "jaccard": []} for topn in topns}
+    totals = {topn: dict.fromkeys(["sumofsetsizes", "sumofintersections", "sumofunions", "failures", "targetmoniformcount", "candidatemoniformcount"], 0) for topn in topns}
+
+    def addrow(column, valid, scores, empty):
+        winnerindex, winnerscore, runnerupscore, ambiguous = pickwinner(scores or [])
+        column["valid"].append(valid); column["winner"].append(winnerindex); column["winnerscore"].append(winnerscore); column["runnerupscore"].append(runnerupscore)
+        column["certainty"].append(winnerscore - runnerupscore if runnerupscore > -1 and winnerscore > -1 else 0)
+        column["ambiguous"].append(ambiguous); column["emptyintersections"].append(empty); column["jaccard"].append(scores)
+
+    for testcase in testcases:                                                  # concept enters the intersection at the larger of its two positions, so the intersection at each topn is one bisect into those
+        if not testcase or len(testcase) < 3:                                   # Same rules as scoretestcases for test cases without a target or enough candidates
+            for topn in topns:
+                addrow(columns[topn], False, None, 0)
+                totals[topn]["failures"] += 1
+            continue
+        targetmoniform = testcase[0]
+        if not targetmoniform:
+            for topn in topns: addrow(columns[topn], True, None, 0)
+            continue
+        targetpositions = firstpositions(targetmoniform)
+        targetorder = sorted(targetpositions.values())
+        targetsizes = [bisect_left(targetorder, topn) for topn in topns]       # Set size of each target prefix
+        pairs = []                                                              # Per candidate: (prefix set sizes, sorted positions at which shared concepts enter the intersection), None without a moniform
+        for candmoniform in testcase[1:]:
+            if not candmoniform:
+                pairs.append(None)
+                continue
+            candpositions = firstpositions(candmoniform)
+            entries = sorted([max(candpositions[concept], targetpositions[concept]) for concept in targetpositions.keys() & candpositions.keys()])
+            candorder = sorted(candpositions.values())
+            pairs.append(([bisect_left(candorder, topn) for topn in topns], entries))
+        for step, topn in enumerate(topns):
+            column = columns[topn]; total = totals[topn]
+            targetlen = targetsizes[step]
+            total["targetmoniformcount"] += 1
+            total["candidatemoniformcount"] += len(testcase) - 1
+            total["sumofsetsizes"] += targetlen
+            scores = []; empty = 0
+            for pair in pairs:
+                if pair is None:
+                    total["failures"] += 1
+                    scores.append(None)
+                    continue
+                candlen = pair[0][step]
+                intersectionlen = bisect_left(pair[1], topn)
+                unionlen = targetlen + candlen - intersectionlen
+                scores.append(intersectionlen / unionlen)
+                total["sumofsetsizes"] += candlen; total["sumofintersections"] += intersectionlen; total["sumofunions"] += unionlen
+                if intersectionlen == 0: empty += 1
+            addrow(column, True, scores, empty)
+    return {topn: {**columns[topn], **totals[topn]} for topn in topns}
+
+def newstats():                                                                 # Counters gathered while scoring. Batches add to the same counters so statistics are merged incrementally
+    return dict.fromkeys(["testsdone", "correct", "incorrect", "nosemantics", "ambiguouscount", "sumofcertainties", "certaintiescount", "sumofsetsizes",
+                          "sumofintersections", "sumofunions", "emptyintersections", "failures", "targetmoniformcount", "candidatemoniformcount"], 0)
+
+def tabulate(batchtruths, scores, firsttest=0):                                # Per-test result table for a scored batch, as columns. Only test cases that had a target and candidates get a row
+    rows = [testindex for testindex, valid in enumerate(scores["valid"]) if valid]
+    winners = [scores["winner"][testindex] for testindex in rows]
+    truths = [batchtruths[testindex] for testindex in rows]
+    ambiguities = [scores["ambiguous"][testindex] for testindex in rows]
+    outcomes = []                                                               # "none" if no candidate had any score, else "win" or "fail", prefixed with "ambiguous" when other candidates tied with the winner
+    for winnerindex, truthindex, ambiguous in zip(winners, truths, ambiguities):
+        if winnerindex == -1: outcomes.append("none")
+        elif winnerindex == truthindex: outcomes.append("ambiguouswin" if ambiguous else "win")   # We allow that in case of several equal top scores we guess at the first one of them and if that is correct, then we are correct
+        else: outcomes.append("ambiguousfail" if ambiguous else "fail")
+    return {"row": rows, "test": [firsttest + testindex for testindex in rows], "truth": truths, "winner": winners,
+            "winnerscore": [scores["winnerscore"][testindex] for testindex in rows], "runnerupscore": [scores["runnerupscore"][testindex] for testindex in rows],
+            "margin": [scores["certainty"][testindex] for testindex in rows], "ambiguous": ambiguities, "outcome": outcomes, "jaccard": [scores["jaccard"][testindex] for testindex in rows]}
+
+def tally(table, scores, stats):                                                # Add counts from a batch's result table and its scores to stats
+    for name in ("sumofsetsizes", "sumofintersections", "sumofunions", "failures", "targetmoniformcount", "candidatemoniformcount"):
+        stats[name] += scores[name]
+    stats["emptyintersections"] += sum(scores["emptyintersections"])
+    outcomes = table["outcome"]
+    stats["testsdone"] += len(outcomes)
+    stats["correct"] += outcomes.count("win") + outcomes.count("ambiguouswin")
+    stats["incorrect"] += outcomes.count("fail") + outcomes.count("ambiguousfail")
+    stats["nosemantics"] += outcomes.count("none")                              # Count documents where we could not discern any semantics for statistics printout at end
+    stats["ambiguouscount"] += sum(table["ambiguous"])
+    stats["sumofcertainties"] += sum(table["margin"])                           # Margin is 0 unless there was both a winner and a runner-up
+    stats["certaintiescount"] += sum(1 for winnerscore, runnerupscore in zip(table["winnerscore"], table["runnerupscore"]) if runnerupscore > -1 and winnerscore > -1)
+
+def renderjaccard(table, testcases, batchpayload):                              # Terminal view demonstrating jaccard score as a distance measure: target text, then one line per candidate with outcome, score and margin
     winoutcome = f"{Fore.GREEN}WIN{Style.RESET_ALL}"
     runnerupoutcome = f"2ND"
     amboutcome = f"{Fore.YELLOW}AMB{Style.RESET_ALL}"
     failoutcome = f"{Fore.RED}FAIL{Style.RESET_ALL}"
-
-    testcases = understandings.get("moniform")                                  # Extract result from returned result + metadata dict/map/JSONObject
-    if not testcases or len(testcases) == 0:
-        return f" ------ No concepts (moniform) entry in {understandings}"      # UM1 did not return a "moniform" field which is quite surprising
-    testindex = 0
-    with open("failedtests.tsv", "w") as of2:                                   # Open failed tests output file
-        for testindex in range(len(testcases)):                                 # Loop over each of the given test cases (typically 200). A testcases is here a list of (typically six) moniforms (lists of numbers), where first is the target
-            testcase = testcases[testindex]
-            if logmisc:print(f"length of testcase={len(testcase)}")
-            if testcase and len(testcase) >= 3:                                 # Required: a target and at least two candidates to decide between. We typically use five candidates, which means six moniforms per sublist
-                targettext = payload[testindex][0]                              # Extract target text for this test case from payload. Note that in payload, there is no truth column so target is index 0
-                targetmoniform = testcase[0]                                    # Understanding of target, as the simplest kind of moniform, alist of integers without duplicates, sorted by declining salience estimates
-                if logmisc:print(f"length of targetmoniform={len(targetmoniform)}")
-                if targetmoniform:
-                    candidatemoniforms = testcase[1:]
-                    targetmoniformcount += 1                                    # Count actual target moniforms in case we have indefinite number of valid test cases
-                    if logmisc:print(f"length of candidatemoniforms={len(candidatemoniforms)}")
-                    if candidatemoniforms:
-                        candidatemoniformcount += len(candidatemoniforms)
-                        targetset = set(targetmoniform)
-                        sumofsetsizes += len(targetset)                         # Gather statistics: We track average size for all moniforms whether target or candidate. This is allowed because they will all be coming from the same source
-                        winnerindex = -1
-                        winnerscore = -1
-                        runnerupscore = -1                                      # "margin" statistic tells us the margin between the winner and the runner-up which is a measure of our certainty of the answer
-                        ambiguous = 0
-                        resulttuples = []
-                        certainty = 0
-                        
-                        for i in range(len(candidatemoniforms)):
-                            candmoniform = candidatemoniforms[i]               # loop over all candidate moniforms
-                            if candmoniform:
-                                if len(candmoniform) == 0: nosemantics += 1
-                                candset = set(candmoniform)
-                                sumofsetsizes += len(candset)                   # Gather statistics
-
-                                intersection = targetset & candset              # Intersection of target moniform and candidate moniform
-                                intersectionlen = len(intersection)
-                                
-                                union = targetset | candset
-                                unionlen = len(union)
-
-                                jaccardscore =  intersectionlen / unionlen      # Compute jaccard distance from target monifor to this candidate moniform
-
-                                if winnerscore == jaccardscore:                 # Tied top score
-                                    runnerupscore = jaccardscore
-                                    ambiguous += 1                              # Mark this as ambiguous
-                                if winnerscore < jaccardscore:                  # New winner
-                                    runnerupscore = winnerscore                 # Previous winner becomes the runner-up
-                                    winnerscore = jaccardscore
-                                    winnerindex = i
-                                    ambiguous = 0                               # If we have a clear winner, then we are not ambiguous
-                                elif runnerupscore < jaccardscore:              # We must handle the case where the new score beats the runner up score but not the winner score
-                                    runnerupscore = jaccardscore
-
-                                sumofintersections += intersectionlen           # Gather statistics
-                                sumofunions += unionlen                         # Gather statistics
-                                if intersectionlen == 0: emptyintersections += 1
-                                truthindex = truths[testindex]
-                                resulttuples.append((i, jaccardscore, candmoniform, payload[testindex][0], payload[testindex][i + 1], truthindex)) # extraxt target and candidate texts from payload. offset 0 is target, rest are candidates
-                            else: failures += 1
-
-                            ## End of loop over candidates
-
-                        if runnerupscore > -1 and winnerscore > -1:
-                            certainty = winnerscore - runnerupscore
-                            sumofcertainties += certainty
-                            certaintiescount += 1
-
-                        if logjaccard:                                             # demonstrate jaccard score as a distance measure
-                            first = True
-                            for index, score, moniform, targettext, candtext, truthindex in resulttuples:
-                                if first:
-                                    print("")
-                                    if logmoniforms: print(f"TARGETMONIFORM:                         {targetmoniform}")
-                                    if logtexts:     print(f"{Fore.YELLOW + Style.BRIGHT}                                                {targettext}{Style.RESET_ALL}")
-                                    first = False
-                                candmoniform = candidatemoniforms[index]
-                                monidisp = moniform if logmoniforms else ""
-                                textdisp = candtext if logtexts else ""
-                                scoredisp = round(100.0 * score, 2)
-                                certaintydisp = round(100.0 * certainty, 2) if score == winnerscore else ""
-                                outcome = ""
-                                if index == winnerindex:
-                                    if truthindex == index:
-                                        if score == runnerupscore:
-                                            outcome = amboutcome
-                                        else:
-                                            outcome = winoutcome
-                                    else:
-                                        outcome = failoutcome
-                                elif score == runnerupscore:
-                                    if winnerscore == runnerupscore:
-                                        outcome = amboutcome
-                                    else:
-                                        outcome = runnerupoutcome
-                                print(f"  {index}\t{outcome}\t{scoredisp}\t{certaintydisp}\t{monidisp}\t{textdisp}\t")
-
-                # End of test case analysis. 
-
-                testsdone += 1                                                  # Gather statistics
-                ambiguouscount += ambiguous                                     # Gather statistics
-
-                if winnerindex == -1:                                           # Ensure we actually have a winner. If not, note that and try next testcase
-                    if logoutcomes:
-                        sys.stdout.write(f"{Fore.BLUE}?")
-                    of.write(f"{Fore.BLUE}?")
-                    nosemantics += 1                                            # Count documents where we could not discern any semantics for statistics printout at end
-                    continue
-
-                if winnerindex == truthindex:
-                    correct += 1                                                # We allow that in case of several equal top scores we guess at the first one of them and if that is correct, then we are correct
-                    if ambiguous:
-                        if logoutcomes:
-                            sys.stdout.write(f"{Fore.GREEN}={Style.RESET_ALL}")     # but we neverteless track that this was an ambiguous win by printing a green equals-sign rather than the guess we guessed
-                        of.write(f"{Fore.GREEN}={Style.RESET_ALL}")
-                        if writefailurefile: of2.write(f"{winnerindex}\t{alllines[testindex]}\n") # Columns are our guess, truth, target, and all candidates
+    lines = []
+    for testindex, winnerindex, winnerscore, runnerupscore, certainty, truthindex, jaccards in zip(table["row"], table["winner"], table["winnerscore"], table["runnerupscore"], table["margin"], table["truth"], table["jaccard"]):
+        if winnerindex == -1: continue
+        lines.append("")
+        if logmoniforms: lines.append(f"TARGETMONIFORM:                         {testcases[testindex][0]}")
+        if logtexts:     lines.append(f"{Fore.YELLOW + Style.BRIGHT}                                                {batchpayload[testindex][0]}{Style.RESET_ALL}")
+        for index, score in enumerate(jaccards):
+            if score is None: continue
+            monidisp = testcases[testindex][index + 1] if logmoniforms else ""
+            textdisp = batchpayload[testindex][index + 1] if logtexts else ""   # Extract candidate texts from payload. offset 0 is target, rest are candidates
+            scoredisp = round(100.0 * score, 2)
+            certaintydisp = round(100.0 * certainty, 2) if score == winnerscore else ""
+            outcome = ""
+            if index == winnerindex:
+                if truthindex == index:
+                    if score == runnerupscore:
+                        outcome = amboutcome
                     else:
-                        if logoutcomes:
-                            sys.stdout.write(f"{Fore.GREEN}{winnerindex}{Style.RESET_ALL}") # Green digit is the index of our correct guess
-                        of.write(f"{Fore.GREEN}{winnerindex}{Style.RESET_ALL}")
+                        outcome = winoutcome
                 else:
-                    incorrect += 1
-                    if writefailurefile: of2.write(f"{winnerindex}\t{alllines[testindex]}\n") # Columns are our guess, truth, target, and all candidates
-                    if ambiguous:
-                        if logoutcomes:
-                            sys.stdout.write(f"{Fore.RED}={Style.RESET_ALL}")       # Ambiguous results where we guessed werong are indicated with a red equals sign
-                        of.write(f"{Fore.RED}={Style.RESET_ALL}")
-                    else:
-                        if logoutcomes:
-                            sys.stdout.write(f"{Fore.RED}{winnerindex}{Style.RESET_ALL}") # Red digit is the index of our erroneous guess
-                        of.write(f"{Fore.RED}{winnerindex}{Style.RESET_ALL}")
-            else: failures += 1
+                    outcome = failoutcome
+            elif score == runnerupscore:
+                if winnerscore == runnerupscore:
+                    outcome = amboutcome
+                else:
+                    outcome = runnerupoutcome
+            lines.append(f"  {index}\t{outcome}\t{scoredisp}\t{certaintydisp}\t{monidisp}\t{textdisp}\t")
+    return "".join(line + "\n" for line in lines)
 
-    # Compute some batch-wide statistics and return a summary of what happened for caller to print if they wish
+def renderoutcomes(table):                                                      # Outcome of each test as a single position character. "=" means ambiguous. "?" means problems. Red is wrong, green is correct guess
+    symbols = {"none": f"{Fore.BLUE}?", "ambiguouswin": f"{Fore.GREEN}={Style.RESET_ALL}", "ambiguousfail": f"{Fore.RED}={Style.RESET_ALL}"}
+    return "".join(symbols.get(outcome) or f"{Fore.GREEN if outcome == 'win' else Fore.RED}{winnerindex}{Style.RESET_ALL}" for outcome, winnerindex in zip(table["outcome"], table["winner"]))
 
-    if logoutcomes: print("");
+def renderfailures(table, batchlines):                                          # Lines for failedtests.tsv: failed and ambiguous tests. Columns are our guess, truth, target, and all candidates
+    return "".join(f"{winnerindex}\t{batchlines[testindex]}\n" for testindex, winnerindex, outcome in zip(table["row"], table["winner"], table["outcome"])
+                   if outcome in ("fail", "ambiguousfail", "ambiguouswin"))
+
+def renderresults(table):                                                       # Rows for the resultspath CSV table. Per-candidate jaccard scores are joined with ";" with an empty field for candidates without a moniform
+    return zip(table["test"], table["truth"], table["winner"], table["winnerscore"], table["runnerupscore"], table["margin"], table["ambiguous"], table["outcome"],
+               (";".join("" if score is None else repr(score) for score in jaccards) for jaccards in table["jaccard"]))
+
+def classifybatch(testcases, batchpayload, batchtruths, batchlines, stats, of, of2=None, results=None, firsttest=0):  # Score one batch of understood test cases, add to stats and hand the result table to the enabled renderers.
+    with timed("score"):                                                        # Texts, truths and lines are indexed like testcases. of2 is failedtests.tsv and results the CSV writer, or None if not wanted
+        if scoringprocesses != 1 and len(testcases) >= parallelminimum:
+            scores = scoreparallel(testcases)                                   # All the set arithmetic happens here, or in scoreparallel
+        else:
+            scores = scoretestcases(testcases)
+        table = tabulate(batchtruths, scores, firsttest)
+        tally(table, scores, stats)
+    with timed("render"):
+        if logjaccard: sys.stdout.write(renderjaccard(table, testcases, batchpayload))   # Each renderer produces one string per batch, written with a single call
+        outcomes = renderoutcomes(table)
+        of.write(outcomes)
+        if logoutcomes: sys.stdout.write(outcomes)
+        if of2 is not None: of2.write(renderfailures(table, batchlines))
+        if results is not None: results.writerows(renderresults(table))
+    return table
+
+def openresults(stack):                                                         # Open enabled output files on an ExitStack. Returns (failure file, results CSV writer), None for those not enabled
+    of2 = stack.enter_context(open("failedtests.tsv", "w")) if writefailurefile else None
+    results = None
+    if resultspath:
+        results = csv.writer(stack.enter_context(open(resultspath, "w", newline="")))
+        results.writerow(resultscolumns)
+    return of2, results
+
+def summarize(stats):                                                           # Compute some batch-wide statistics and return a summary of what happened for caller to print if they wish
+    testsdone = stats["testsdone"]; sumofsetsizes = stats["sumofsetsizes"]
+    moniformcount = stats["targetmoniformcount"] + stats["candidatemoniformcount"]
     accuracy = 0
     avgsetsize = 0
     avgintersectionsize = 0
     margin = 0
-    if candidatemoniformcount > 0:
-        avgsetsize = round(sumofsetsizes / (targetmoniformcount + candidatemoniformcount), 2)
-        avgintersectionsize = round(sumofintersections / (targetmoniformcount + candidatemoniformcount), 2)
-        avgunionsize = round(sumofunions / (targetmoniformcount + candidatemoniformcount), 2)
+    if stats["candidatemoniformcount"] > 0:
+        avgsetsize = round(sumofsetsizes / moniformcount, 2)
+        avgintersectionsize = round(stats["sumofintersections"] / moniformcount, 2)
     if testsdone > 0 and sumofsetsizes > 0:
-        accuracy = round(100.0 * float(correct) / float(testsdone), 1)
-        margin = round(100.0 * float(sumofcertainties) / float(testsdone), 2)
-    return f"{Fore.GREEN}Accuracy:{accuracy:>5}% {Fore.YELLOW} avg-margin:{margin:>5}%{Style.RESET_ALL} testsdone:{testsdone:<6} understanding-failures:{failures:<4} meaningless:{nosemantics:<4}avg-setsize:{avgsetsize:<6} avg-intersections:{avgintersectionsize:<6} empty-intersections:{emptyintersections:<4} ambiguous:{ambiguouscount:<4} testfileproblems:{testfileproblems:<4}{Style.RESET_ALL}"
+        accuracy = round(100.0 * float(stats["correct"]) / float(testsdone), 1)
+        margin = round(100.0 * float(stats["sumofcertainties"]) / float(testsdone), 2)
+    return f"{Fore.GREEN}Accuracy:{accuracy:>5}% {Fore.YELLOW} avg-margin:{margin:>5}%{Style.RESET_ALL} testsdone:{testsdone:<6} understanding-failures:{stats['failures']:<4} meaningless:{stats['nosemantics']:<4}avg-setsize:{avgsetsize:<6} avg-intersections:{avgintersectionsize:<6} empty-intersections:{stats['emptyintersections']:<4} ambiguous:{stats['ambiguouscount']:<4} testfileproblems:{testfileproblems:<4}{Style.RESET_ALL}"
+
+def classifyunderstandings(understandings, of):                                 # understandings is a JSONObject -- it has a few fields of returned metadata, and the result itself is in the field "moniform"
+    global testsdone
+    testcases = understandings.get("moniform")                                  # Extract result from returned result + metadata dict/map/JSONObject
+    if not testcases or len(testcases) == 0:
+        return f" ------ No concepts (moniform) entry in {understandings}"      # UM1 did not return a "moniform" field which is quite surprising
+    stats = newstats()
+    with ExitStack() as stack:
+        of2, results = openresults(stack)                                       # Failed tests and results table files are only opened if they are enabled
+        classifybatch(testcases, payload, truths, alllines, stats, of, of2, results)   # Entire payload is one batch, with texts, truths and lines in globals
+    testsdone = stats["testsdone"]
+    if logoutcomes: print("");
+    return summarize(stats)
+
+def writetelemetry(options, starttime, elapsed, testsdone, servicems, competenceuuid):   # Print a per-stage breakdown of this run and append it as a JSON record to telemetrypath
+    latency = percentiles(chunklatencies, 1000)
+    servicetimes = percentiles([ms for ms in chunkservicems if ms is not None])
+    record = {"time": datetime.fromtimestamp(starttime).isoformat(timespec='seconds'), "options": options, "testpath": testpath, "competenceuuid": competenceuuid,
+              "tests": testsdone, "samples": numberunderstandings, "chars": totaltestchars, "elapsedms": round(1000 * elapsed, 1),
+              "stagems": {stage: round(1000 * seconds, 1) for stage, seconds in stageseconds.items()},
+              "chunklatencyms": latency, "chunkservicems": servicetimes, "servicems": servicems,
+              "clientms": round(1000 * chunklatencytotal - chunkservicetotal, 1),   # Time chunks spent in round trips that the server did not account for: network, queueing, serialization and decoding
+              "roundtripms": round(1000 * roundtripseconds, 1), "bytessent": bytessent, "bytesreceived": bytesreceived}
+    if usecache: record["cache"] = {"hits": cachehits, "misses": cachemisses, "duplicates": cacheduplicates}
+    if tracemalloc.is_tracing(): record["tracemallocpeakbytes"] = tracemalloc.get_traced_memory()[1]
+    stages = "  ".join(f"{stage} {ms}" for stage, ms in record["stagems"].items())
+    print(f"Stages (ms): {stages}   UM-1 round trips {record['roundtripms']} ms   Chunk latency p50/p95/p99: {latency.get('p50')}/{latency.get('p95')}/{latency.get('p99')} ms over {latency['count']} chunks   Sent {bytessent // 1024} KB  Received {bytesreceived // 1024} KB")
+    with open(telemetrypath, "a") as telemetryfile:
+        telemetryfile.write(json.dumps(record) + "\n")
 
 def classifyall(options):
     global um1service, saliencers, testsdone, numberunderstandings, payload
@@ -238,22 +852,36 @@ def classifyall(options):
         print("Cannot use logjaccard and logoutcomes together at this time. Please set one of these two flags to False")
         return
     numberunderstandings = 0 ; starttime = time.time();  serverclass = options.get("server")
-    payload = createpayload()                                                   # Make payload globally available so we can translate results back into strings
-    if logmisc:
-        print(f"Payload={payload}")
-        print(f"len(payload)={len(payload)}")
-        print(f"len(payload[1])={len(payload[1])}")
+    resettelemetry(); resetcachestats()
     if logtraffic:print(f"serverclass is {serverclass}   um1service URL is {um1service}  options is {options}")
-    understandings = understand(payload, options)
+    if streambatchsize:
+        payload = None
+        batches = understandbatches(options)                                    # Batches are read, understood and scored one after the other. First one provides the metadata
+        numbertests = maxtestlines or 0                                         # We do not know how many tests there are until we are done. Header is only printed if maxtestlines is set
+    else:
+        payload = createpayload()                                               # Make payload globally available so we can translate results back into strings
+        if logmisc:
+            print(f"Payload={payload}")
+            print(f"len(payload)={len(payload)}")
+            print(f"len(payload[1])={len(payload[1])}")
+        understood = understandroundtrip(payload, options)
+        batches = iter([(payload, truths, alllines, understood)])
+        numbertests = len(payload)
+    pending = []                                                                # Batches up to and including the first one UM1 understood. Run metadata comes from that one
+    for first in batches:
+        pending.append(first)
+        if first[3] and first[3].get("moniform"): break
+    understandings = next((batch[3] for batch in reversed(pending) if batch[3]), None)
+    batches = chain(pending, batches)                                           # Failed batches before it are still scored below, as understanding failures
+    first = next(batches, None)
     if logtraffic:print(f"understandings={understandings}")
+    if not understandings: print(f"UM-1 gave no understanding for any batch of tests from {testpath}")
     if understandings:
-        numbertests = len(alllines)
         totalticks = understandings.get("totalticks")
         uptimesecs = understandings.get("uptimesecs")
         corpussize = understandings.get("corpussize")
         createdzulu = understandings.get("createdzulu")
         competenceid = understandings.get("competenceid")
-        testruntimems = understandings.get("ms")
         competenceuuid = understandings.get("competenceuuid")
         learningtimesecs = understandings.get("learningtimesecs")
         with open("semsimout.txt", "a") as of:
@@ -282,7 +910,29 @@ def classifyall(options):
             if logjaccard: 
                 print(f"\nIndex   Outcome Jaccard Margin")
                 print(f"==============================")
-            summary = classifyunderstandings(understandings, of)                # Sets testsdone
+            stats = newstats()
+            testruntimems = 0
+            batchcount = 0
+            firsttest = 0
+            with ExitStack() as stack:
+                of2, results = openresults(stack)                               # Failed tests and results table files are only opened if they are enabled
+                while first:
+                    batchpayload, batchtruths, batchlines, understandings = first
+                    testcases = understandings.get("moniform") if understandings else None
+                    if testcases:
+                        classifybatch(testcases, batchpayload, batchtruths, batchlines, stats, of, of2, results, firsttest)
+                        testruntimems += understandings.get("ms") or 0          # Service time is the sum of the service times of all batches
+                    else:
+                        print(f" ------ No concepts (moniform) entry in {understandings}")  # Whole batch failed. Count its tests as understanding failures and go on with the next batch
+                        stats["failures"] += len(batchpayload)
+                    batchcount += 1
+                    firsttest += len(batchpayload)
+                    if streambatchsize and logprogress and not logoutcomes:
+                        print(f"Batch {batchcount}: {stats['testsdone']} tests scored, {stats['correct']} correct, {int(1000 * (time.time() - starttime))} ms so far")
+                    first = next(batches, None)
+            testsdone = stats["testsdone"]
+            if logoutcomes: print("");
+            summary = summarize(stats)
             if logjaccard:
                 print(f"  ^      ^       ^        ^   ")
                 print(f"Index   Outcome Jaccard Margin\n")
@@ -302,7 +952,98 @@ def classifyall(options):
                 avgstring = ""
                 avbbackendtime = ""
             print(f"For {testsdone} tests with a total of {numberunderstandings} samples, total {totaltestchars} chars, real time was {int(elapsed * 1000):>5} ms {avgstring}  Batch service time: {servicetime} ms{avbbackendtime}")  
+            if usecache: print(f"Moniform cache: {cachehits} hits  {cachemisses} misses  {cacheduplicates} duplicate strings not sent  Cache file: {cachepath}")
+            if telemetry: writetelemetry(options, starttime, elapsed, testsdone, testruntimems, competenceuuid)
             testsdone = 0
+            return stats                                                        # Counters of the run, for callers such as bench.py
             
+def checkprefixes(sample, moniforms, topns, options):                          # Ask UM1 again for the texts in sample at each smaller topn and compare with prefixes of moniforms, their understanding at the largest topn.
+    report = []                                                                 # Returns a list of (topn, moniforms compared, number that were exact prefixes, mean overlap with the prefix, error or None)
+    for topn in sorted(set(topns))[:-1]:
+        understanding = understand(sample, {**options, "topn": topn})
+        if not understanding or understanding.get("error") or not understanding.get("moniform"):
+            report.append((topn, 0, 0, 0.0, (understanding or {}).get("error") or "UM-1 gave no understanding"))
+            continue
+        compared = 0; exact = 0; overlap = 0.0
+        for testcase, largetestcase in zip(understanding.get("moniform") or [], moniforms):
+            for moniform, largemoniform in zip(testcase or [], largetestcase or []):
+                if not moniform or not largemoniform: continue
+                prefix = list(largemoniform[:topn]); moniform = list(moniform)
+                compared += 1
+                if moniform == prefix: exact += 1
+                overlap += len(set(moniform) & set(prefix)) / len(set(moniform) | set(prefix))
+        report.append((topn, compared, exact, overlap / compared if compared else 0.0, None))
+    return report
+
+def sweeptopns(options, topns):                                                 # Understand the test file once at the largest topn and report accuracy, margin and ambiguity at every topn in topns by scoring moniform prefixes
+    global payload, testsdone
+    topns = sorted(set(topns))
+    options = {**options, "topn": topns[-1]}
+    starttime = time.time()
+    resettelemetry(); resetcachestats()
+    if streambatchsize:
+        batches = understandbatches(options)
+    else:
+        payload = createpayload()
+        batches = iter([(payload, truths, alllines, understandroundtrip(payload, options))])
+    stats = {topn: newstats() for topn in topns}
+    sample = []; samplemoniforms = []; scoringseconds = 0
+    for batchpayload, batchtruths, batchlines, understandings in batches:
+        testcases = understandings.get("moniform") if understandings else None
+        if not testcases:
+            print(f" ------ No concepts (moniform) entry in {understandings}")
+            for topn in topns: stats[topn]["failures"] += len(batchpayload)
+            continue
+        if len(sample) < sweepcheck:
+            sample += batchpayload[:sweepcheck - len(sample)]; samplemoniforms += testcases[:sweepcheck - len(samplemoniforms)]
+        scoringstart = time.perf_counter()
+        with timed("score"):
+            for topn, scores in scoreprefixes(testcases, topns).items():
+                tally(tabulate(batchtruths, scores), scores, stats[topn])
+        scoringseconds += time.perf_counter() - scoringstart                    # Kept here too, since stageseconds is only filled with telemetry on
+    lines = [f"Topn sweep of {testpath}, understood once at topn {topns[-1]}. Options: {options}",
+             " topn  accuracy  avg-margin  ambiguous  meaningless  empty-intersections  avg-setsize"]
+    for topn in topns:
+        topnstats = stats[topn]; done = topnstats["testsdone"]
+        moniformcount = topnstats["targetmoniformcount"] + topnstats["candidatemoniformcount"]
+        accuracy = round(100.0 * topnstats["correct"] / done, 1) if done else 0
+        margin = round(100.0 * topnstats["sumofcertainties"] / done, 2) if done else 0
+        avgsetsize = round(topnstats["sumofsetsizes"] / moniformcount, 2) if moniformcount else 0
+        lines.append(f"{topn:>5}  {accuracy:>7}%  {margin:>9}%  {topnstats['ambiguouscount']:>9}  {topnstats['nosemantics']:>11}  {topnstats['emptyintersections']:>19}  {avgsetsize:>11}")
+    lines.append(f"Sweep of {len(topns)} topn values over {stats[topns[-1]]['testsdone']} tests took {int(1000 * (time.time() - starttime))} ms, of which scoring {int(1000 * scoringseconds)} ms")
+    testsdone = stats[topns[-1]]["testsdone"]
+    with open("semsimout.txt", "a") as of:                                      # The curve is saved before the prefix check, which needs more UM1 requests that may fail
+        of.write("\n" + 304 * '=' + "\n")
+        of.write("\n".join(lines) + "\n")
+        print("\n".join(lines))
+        if sample and len(topns) > 1:
+            for topn, compared, exact, overlap, error in checkprefixes(sample, samplemoniforms, topns, options):
+                if error:
+                    line = f"Prefix check at topn {topn}: not checked, {error}"
+                else:
+                    line = f"Prefix check at topn {topn}: {exact} of {compared} moniforms of {len(sample)} tests are exact prefixes of the topn {topns[-1]} moniforms, mean jaccard with the prefix {overlap:.3f}"
+                of.write(line + "\n")
+                print(line)
+    return stats
+
 if __name__ == '__main__':          
-    classifyall({"topn" : 60, "debug" : False})
+    parser = argparse.ArgumentParser(description="Document similarity classification test against UM1. Other settings are the flags at the top of this file")
+    parser.add_argument("--profile", metavar="FILE", help="run under cProfile, print the top functions and save the stats to FILE for python -m pstats")
+    parser.add_argument("--tracemalloc", action="store_true", help="trace memory allocations, add the peak to telemetry and print the top allocation sites")
+    parser.add_argument("--notelemetry", action="store_true", help="do not time stages or write telemetry records")
+    parser.add_argument("--sweep", metavar="TOPN", type=int, nargs="+", help="instead of the standard test, understand once at the largest TOPN and report accuracy, margin and ambiguity at every TOPN")
+    args = parser.parse_args()
+    if args.notelemetry: telemetry = False
+    if args.tracemalloc: tracemalloc.start()
+    if args.sweep:
+        sweeptopns({"debug" : False}, args.sweep)
+    elif args.profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(classifyall, {"topn" : 60, "debug" : False})
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+    else:
+        classifyall({"topn" : 60, "debug" : False})
+    if args.tracemalloc:
+        print(f"tracemalloc peak: {tracemalloc.get_traced_memory()[1] // 1024} KB. Top allocation sites:")
+        for statistic in tracemalloc.take_snapshot().statistics("lineno")[:10]: print(f"  {statistic}")
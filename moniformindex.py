@@ -0,0 +1,164 @@
+#! /usr/bin/env python3     # -*-python-*-
+# coding: utf-8
+# moniformindex --  Corpus-wide similarity search over moniforms returned from UM1
+# f.py compares a target with the few candidates on its own test line. These indexes instead hold a whole corpus of understood
+# documents and answer "which documents are most similar (by Jaccard over concept ids) to this moniform" without comparing with all of them.
+# InvertedIndex is exact: concept id -> posting list, rarest concepts first, with candidate pruning and exact verification.
+# MinHashIndex is approximate: MinHash signatures in LSH bands. More bands and fewer rows per band give higher recall and more candidates to verify.
+# Both support incremental add(), search(), duplicates() and save()/load()
+# Use this code at your own risk any way you want
+
+import pickle, random, heapq
+from array import array
+
+class MoniformIndex:                                                            # Storage and exact verification shared by both kinds of index. Subclasses supply candidates()
+    def __init__(self):
+        self.keys = []                                                          # Caller's key for each document (text, id, ...), indexed by document number
+        self.documents = []                                                     # Moniform of each document as a sorted array of distinct concept ids
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, key, moniform):                                               # Add one understood document. Returns its document number
+        document = array('i', sorted(set(moniform)))
+        documentnumber = len(self.documents)
+        self.keys.append(key)
+        self.documents.append(document)
+        self.insert(documentnumber, document)
+        return documentnumber
+
+    def addall(self, keys, moniforms):
+        for key, moniform in zip(keys, moniforms):
+            self.add(key, moniform)
+
+    def search(self, moniform, k=10, threshold=0.0, exclude=None):              # Return up to k (score, document number, key) tuples with Jaccard score >= threshold, best first. Ties go to lower document numbers
+        query = set(moniform)
+        if not query: return []
+        scored = []
+        for documentnumber in self.candidates(query, k, threshold, exclude):
+            if documentnumber == exclude: continue
+            document = self.documents[documentnumber]
+            intersectionlen = len(query.intersection(document))                 # Exact verification of each candidate
+            if intersectionlen == 0: continue
+            score = intersectionlen / (len(query) + len(document) - intersectionlen)
+            if score >= threshold: scored.append((score, -documentnumber))
+        return [(score, -negative, self.keys[-negative]) for score, negative in heapq.nlargest(k, scored)]
+
+    def duplicates(self, threshold=0.5, k=10):                                  # Return (score, document number, document number) for all pairs of documents at least threshold similar, e.g. QQP-style duplicate questions
+        pairs = []
+        for documentnumber, document in enumerate(self.documents):
+            for score, other, key in self.search(document, k + 1, threshold, exclude=documentnumber):
+                if other > documentnumber: pairs.append((score, documentnumber, other))
+        return sorted(pairs, reverse=True)
+
+    def save(self, path):
+        with open(path, "wb") as out:
+            pickle.dump(self, out, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as infile:
+            return pickle.load(infile)
+
+class InvertedIndex(MoniformIndex):                                             # Exact top-k search
+    def __init__(self):
+        super().__init__()
+        self.postings = {}                                                      # Concept id -> array of document numbers containing it, in increasing order
+
+    def insert(self, documentnumber, document):
+        for concept in document:
+            posting = self.postings.get(concept)
+            if posting is None:
+                self.postings[concept] = posting = array('i')
+            posting.append(documentnumber)
+
+    def candidates(self, query, k, threshold, exclude=None):                    # Documents other than exclude that can possibly reach the top k. Concepts are visited rarest first. A document first seen after visiting
+        querylen = len(query)                                                   # all but r query concepts shares at most r concepts with the query, so its score is at most r / querylen. Once that is
+        concepts = sorted(query, key=lambda concept: len(self.postings.get(concept, ())))   # below both threshold and the k-th best lower bound among documents seen so far, we stop looking at postings
+        counts = {}                                                             # Document number -> number of query concepts seen in it so far, a lower bound on its intersection
+        for visited, concept in enumerate(concepts):
+            remaining = querylen - visited
+            bound = remaining / querylen                                        # Best possible score of any document we have not yet seen
+            if bound < threshold: break
+            if len(counts) >= k and bound < self.kthlowerbound(counts, querylen, k): break
+            for documentnumber in self.postings.get(concept, ()):
+                if documentnumber != exclude:                                   # The excluded document (usually the query itself) must not count towards the k-th bound
+                    counts[documentnumber] = counts.get(documentnumber, 0) + 1
+        return counts
+
+    def kthlowerbound(self, counts, querylen, k):                               # k-th best guaranteed score among seen documents. A document sharing at least c concepts scores at least c / (querylen + size - c)
+        documents = self.documents
+        return heapq.nlargest(k, (count / (querylen + len(documents[documentnumber]) - count) for documentnumber, count in counts.items()))[-1]
+
+class MinHashIndex(MoniformIndex):                                              # Approximate search. A document becomes a candidate if all rows of at least one band of its signature match the query's
+    prime = (1 << 31) - 1
+
+    def __init__(self, bands=32, rows=2, seed=1):                               # Two documents with Jaccard s collide in some band with probability 1 - (1 - s**rows)**bands
+        super().__init__()
+        self.bands = bands
+        self.rows = rows
+        self.seed = seed
+        self.buckets = [{} for band in range(bands)]                            # One dict per band: hash of band's signature rows -> list of document numbers
+        self.sethashes()
+
+    def sethashes(self):                                                        # Random hash functions (a * x + b) mod prime, one per signature row
+        rng = random.Random(self.seed)
+        self.hashes = [(rng.randrange(1, self.prime), rng.randrange(self.prime)) for permutation in range(self.bands * self.rows)]
+        self.hashcache = {}                                                     # Concept id -> array of its value under every hash function. Concepts recur across documents so each is hashed once
+
+    def __getstate__(self):                                                     # Hash functions are rebuilt from seed on load rather than saved
+        state = dict(self.__dict__)
+        del state["hashes"], state["hashcache"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.sethashes()
+
+    def signature(self, moniform):                                              # MinHash signature: for each hash function, the smallest hash value over the concepts of the moniform
+        cache = self.hashcache
+        prime = self.prime
+        values = []
+        for concept in moniform:
+            hashed = cache.get(concept)
+            if hashed is None:
+                cache[concept] = hashed = array('i', [(a * concept + b) % prime for a, b in self.hashes])
+            values.append(hashed)
+        return list(map(min, *values)) if len(values) > 1 else list(values[0])
+
+    def bandkeys(self, signature):
+        rows = self.rows
+        return [hash(tuple(signature[band * rows:(band + 1) * rows])) for band in range(self.bands)]
+
+    def insert(self, documentnumber, document):
+        if not len(document): return
+        for buckets, key in zip(self.buckets, self.bandkeys(self.signature(document))):
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = bucket = []
+            bucket.append(documentnumber)
+
+    def candidates(self, query, k, threshold, exclude=None):
+        found = set()
+        for buckets, key in zip(self.buckets, self.bandkeys(self.signature(query))):
+            found.update(buckets.get(key, ()))
+        return found
+
+def bruteforce(documents, moniform, k=10, threshold=0.0, exclude=None):        # Reference top-k by comparing with every document, with the same ordering and tie rules as MoniformIndex.search()
+    query = set(moniform)
+    scored = []
+    for documentnumber, document in enumerate(documents):
+        if documentnumber == exclude: continue
+        intersectionlen = len(query.intersection(document))
+        if intersectionlen == 0: continue
+        score = intersectionlen / (len(query) + len(set(document)) - intersectionlen)
+        if score >= threshold: scored.append((score, -documentnumber))
+    return [(score, -negative) for score, negative in heapq.nlargest(k, scored)]
+
+def indextexts(index, texts, options):                                          # Understand texts with UM1 (through the f.py transport and cache settings) and add them to index with the texts as keys
+    import f
+    understanding = f.understandcached(texts, options) if f.usecache else f.understand(texts, options)
+    if not understanding or understanding.get("error") or not understanding.get("moniform"):
+        return understanding
+    index.addall(texts, understanding["moniform"])
+    return understanding
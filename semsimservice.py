@@ -0,0 +1,181 @@
+#! /usr/bin/env python3     # -*-python-*-
+# coding: utf-8
+# semsimservice --  Long-running micro-batching classification service in front of UM1
+# Clients POST {"target": "...", "candidates": ["...", "..."]} to /classify and get back the winning candidate with its Jaccard score and margin.
+# Requests arriving close together are coalesced into one nested payload, as f.py sends a test file, so UM1 sees one round trip per batch
+# instead of one per request. A batch is sent when it has maxbatchsize requests or its oldest request has waited maxwaitms.
+# Scoring is f.scoretestcases, so winners, ties and margins are decided exactly as in the standard test. GET /metrics returns latency and batch fill.
+# Transport settings (chunksize, maxconnections, retries, usecache ...) are the flags in f.py
+# Use this code at your own risk any way you want
+
+import json, time, asyncio, argparse
+from collections import deque
+import f
+
+maxbatchsize = 64                                                               # Send a batch to UM1 as soon as it has this many requests
+maxwaitms = 10                                                                  # ... or when its first request has waited this long
+maxbatchesinflight = 4                                                          # Batches being understood by UM1 at the same time. While none can be sent, requests queue up and the next batch grows fuller
+maxrequestbytes = 1 << 20                                                       # Larger request bodies are refused
+latencywindow = 10000                                                           # Latency percentiles are over this many most recent requests
+
+options = {"topn": 60, "debug": False}                                          # Understanding options sent with every batch
+queue = None                                                                    # asyncio.Queue of (testcase, future, arrival time) waiting to be batched
+inflight = None                                                                 # asyncio.Semaphore limiting batches in flight
+batchertask = None                                                              # The running batcher(). Held here so it is not garbage collected
+starttime = time.time()
+requestlatencies = deque(maxlen=latencywindow)                                  # Seconds from request arrival to its answer being ready
+batchlatencies = deque(maxlen=latencywindow)                                    # Seconds UM1 took per batch, as seen from here
+counters = dict.fromkeys(["requests", "answered", "failed", "rejected", "batches", "batchedrequests", "fullbatches", "timedoutbatches"], 0)
+
+def metrics():                                                                  # Snapshot of service metrics as a dict, served at /metrics
+    batches = counters["batches"]
+    return {"uptimesecs": int(time.time() - starttime), **counters, "queued": queue.qsize() if queue else 0, "maxbatchsize": maxbatchsize, "maxwaitms": maxwaitms,
+            "meanbatchsize": round(counters["batchedrequests"] / batches, 2) if batches else 0,
+            "meanbatchfill": round(counters["batchedrequests"] / (batches * maxbatchsize), 3) if batches else 0,   # Fraction of maxbatchsize used, averaged over batches
+            "requestlatencyms": f.percentiles(requestlatencies, 1000), "batchlatencyms": f.percentiles(batchlatencies, 1000)}
+
+def answer(scores, testindex):                                                  # Reply for one request from the columns f.scoretestcases returned for its batch
+    return {"winner": scores["winner"][testindex], "winnerscore": scores["winnerscore"][testindex], "runnerupscore": scores["runnerupscore"][testindex],
+            "margin": scores["certainty"][testindex], "ambiguous": scores["ambiguous"][testindex], "jaccard": scores["jaccard"][testindex]}
+
+async def batcher():                                                            # Form batches from the queue for as long as the service runs
+    loop = asyncio.get_running_loop()
+    while True:
+        await inflight.acquire()                                                # While all slots are busy, requests keep queueing and the next batch takes them all at once
+        batch = [await queue.get()]                                             # Block until there is work, then collect more until the batch is full or the first request's wait is over
+        deadline = batch[0][2] + maxwaitms / 1000.0
+        while len(batch) < maxbatchsize:
+            if not queue.empty():
+                batch.append(queue.get_nowait())                                # Requests that are already waiting go in regardless of the deadline
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0: break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        counters["fullbatches" if len(batch) == maxbatchsize else "timedoutbatches"] += 1
+        asyncio.ensure_future(classifybatch(batch))
+
+async def classifybatch(batch):                                                 # Understand one batch with a single UM1 call (split into chunks only if larger than f.chunksize) and answer each request in it
+    loop = asyncio.get_running_loop()
+    try:
+        payload = [testcase for testcase, future, arrival in batch]
+        started = loop.time()
+        understanding = await loop.run_in_executor(None, f.understandcached if f.usecache else f.understand, payload, options)   # f.py transport is blocking, so it runs in a thread
+        batchlatencies.append(loop.time() - started)
+        counters["batches"] += 1; counters["batchedrequests"] += len(batch)
+        testcases = understanding.get("moniform") if understanding else None
+        if not testcases or understanding.get("error"):
+            error = (understanding or {}).get("error") or "UM1 gave no understanding"
+            for testcase, future, arrival in batch:
+                if not future.done(): future.set_result((502, {"error": error}))
+            return
+        scores = f.scoretestcases(testcases)
+        for testindex, (testcase, future, arrival) in enumerate(batch):
+            if future.done(): continue                                          # Client went away
+            if scores["valid"][testindex]:
+                future.set_result((200, {**answer(scores, testindex), "batchsize": len(batch)}))
+            else:
+                future.set_result((502, {"error": "UM1 gave no understanding for this request"}))
+    except Exception as err:
+        for testcase, future, arrival in batch:
+            if not future.done(): future.set_result((500, {"error": f"{type(err).__name__}: {err}"}))
+    finally:
+        inflight.release()
+
+async def classify(request):                                                    # Queue one request and wait for its batch. Returns (HTTP status, reply)
+    target = request.get("target") if isinstance(request, dict) else None
+    candidates = request.get("candidates") if isinstance(request, dict) else None
+    if not isinstance(target, str) or not isinstance(candidates, list) or len(candidates) < 2 or not all(isinstance(candidate, str) for candidate in candidates):
+        counters["rejected"] += 1
+        return 400, {"error": "expected {\"target\": string, \"candidates\": [two or more strings]}"}
+    loop = asyncio.get_running_loop()
+    arrival = loop.time()
+    future = loop.create_future()
+    counters["requests"] += 1
+    await queue.put(([target] + candidates, future, arrival))
+    status, reply = await future
+    latency = loop.time() - arrival
+    requestlatencies.append(latency)
+    counters["answered" if status == 200 else "failed"] += 1
+    reply["latencyms"] = round(1000 * latency, 2)
+    return status, reply
+
+async def handleconnection(reader, writer):                                     # Minimal HTTP/1.1 with keep-alive: POST /classify and GET /metrics
+    try:
+        while True:
+            requestline = await reader.readline()
+            if not requestline: break
+            method, path, version = (requestline.decode("latin-1").split() + ["", "", ""])[:3]
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""): break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = headers.get("content-length") or "0"
+            length = int(length) if length.isascii() and length.isdigit() else -1
+            close = headers.get("connection", "").lower() == "close" or version == "HTTP/1.0"
+            if length < 0:                                                      # Without a valid length we cannot tell where the body ends, so the connection cannot be reused
+                counters["rejected"] += 1
+                status, reply, close = 400, {"error": "invalid Content-Length"}, True
+            elif length > maxrequestbytes:                                      # Refuse without reading the body and drop the connection
+                counters["rejected"] += 1
+                status, reply, close = 413, {"error": "request too large"}, True
+            else:
+                body = await reader.readexactly(length) if length else b""
+                if method == "POST" and path == "/classify":
+                    try:
+                        status, reply = await classify(json.loads(body))
+                    except ValueError:
+                        counters["rejected"] += 1
+                        status, reply = 400, {"error": "request body is not JSON"}
+                elif method == "GET" and path == "/metrics":
+                    status, reply = 200, metrics()
+                else:
+                    status, reply = 404, {"error": f"no {method} {path}. Use POST /classify or GET /metrics"}
+            data = json.dumps(reply).encode("utf-8")
+            writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n{'Connection: close' + chr(13) + chr(10) if close else ''}\r\n".encode("latin-1") + data)
+            await writer.drain()
+            if close: break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def startservice(host="127.0.0.1", port=8090):                            # Start batching and listening. Returns the asyncio server. Port 0 picks a free port
+    global queue, inflight, starttime, batchertask
+    queue = asyncio.Queue(); inflight = asyncio.Semaphore(maxbatchesinflight); starttime = time.time()
+    requestlatencies.clear(); batchlatencies.clear()
+    for name in counters: counters[name] = 0
+    batchertask = asyncio.ensure_future(batcher())
+    return await asyncio.start_server(handleconnection, host, port)
+
+async def serve(host, port, reportsecs):
+    server = await startservice(host, port)
+    print(f"Classification service on http://{host}:{server.sockets[0].getsockname()[1]}/classify in front of {f.um1service}  maxbatchsize: {maxbatchsize}  maxwaitms: {maxwaitms}  options: {options}")
+    async with server:
+        while True:
+            await asyncio.sleep(reportsecs)
+            report = metrics()
+            latency = report["requestlatencyms"]
+            print(f"{report['answered']} answered  {report['failed']} failed  {report['batches']} batches  mean batch {report['meanbatchsize']} ({100 * report['meanbatchfill']:.0f}% full)  "
+                  f"request latency p50/p95/p99: {latency.get('p50')}/{latency.get('p95')}/{latency.get('p99')} ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Micro-batching semantic similarity classification service in front of UM1")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--service", default=f.um1service, help="UM1 /understand URL, for example a um1stub.py")
+    parser.add_argument("--topn", type=int, default=options["topn"])
+    parser.add_argument("--maxbatchsize", type=int, default=maxbatchsize)
+    parser.add_argument("--maxwaitms", type=float, default=maxwaitms)
+    parser.add_argument("--report", type=float, default=10, help="seconds between metrics lines")
+    args = parser.parse_args()
+    f.um1service = args.service; options["topn"] = args.topn
+    maxbatchsize = args.maxbatchsize; maxwaitms = args.maxwaitms
+    try:
+        asyncio.run(serve(args.host, args.port, args.report))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,97 @@
+#! /usr/bin/env python3     # -*-python-*-
+# coding: utf-8
+# um1stub --  Local stand-in for the UM1 /understand endpoint returning synthetic moniforms
+# Use it to test and time f.py without the free UM1 service: start it, then set um1service in f.py to its URL
+# Moniforms are made from crc32 hashes of the words in each string, padded to topn with ids drawn from a generator seeded by the string,
+# so identical strings always get identical moniforms and strings sharing words get overlapping moniforms
+# Use this code at your own risk any way you want
+
+import json, time, random, zlib, argparse, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+conceptcount = 50000                                                            # Size of synthetic concept id space
+latencyms = 0                                                                   # Extra delay added to each request
+failrate = 0.0                                                                  # Fraction of requests answered with HTTP 503 to exercise client retries
+competenceuuid = "00000000-0000-0000-0000-00000000stub"
+starttime = time.time()
+requestcount = 0
+requestlock = threading.Lock()
+
+def syntheticmoniform(text, topn):                                              # A list of distinct integers in "salience" order: words first, then seeded padding
+    moniform = []
+    seen = set()
+    for word in text.lower().split():
+        word = word.strip("?!.,;:\"'()")
+        if not word: continue
+        concept = zlib.crc32(word.encode("utf-8")) % conceptcount
+        if concept not in seen:
+            seen.add(concept)
+            moniform.append(concept)
+    rng = random.Random(zlib.crc32(text.encode("utf-8")))
+    while len(moniform) < topn and len(seen) < conceptcount:
+        concept = rng.randrange(conceptcount)
+        if concept not in seen:
+            seen.add(concept)
+            moniform.append(concept)
+    return moniform[:topn]
+
+def understandnested(payload, topn):                                            # Payload is a (possibly deep) nesting of lists with strings at the leaves. Result has the same shape with moniforms at the leaves
+    if isinstance(payload, str):
+        return syntheticmoniform(payload, topn)
+    return [understandnested(item, topn) for item in payload]
+
+class UnderstandHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"                                               # Keep-alive, so clients can reuse pooled connections
+
+    def do_POST(self):
+        global requestcount
+        with requestlock:
+            requestcount += 1
+        started = time.perf_counter()
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if latencyms: time.sleep(latencyms / 1000.0)
+        if failrate and random.random() < failrate:
+            self.reply(503, {"error": "stub injected failure"})
+            return
+        try:
+            request = json.loads(body)
+            topn = int(request.get("options", {}).get("topn", 60))
+            moniform = understandnested(request["payload"], topn)
+        except Exception as err:
+            self.reply(400, {"error": f"bad request: {err}"})
+            return
+        ms = int(1000 * (time.perf_counter() - started))
+        self.reply(200, {"moniform": moniform, "ms": ms, "totalticks": ms, "uptimesecs": int(time.time() - starttime), "corpussize": 0,
+                         "createdzulu": "", "competenceid": "stub", "competenceuuid": competenceuuid, "learningtimesecs": 0})
+
+    def reply(self, status, result):
+        data = json.dumps(result).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):                                       # Silence per-request logging
+        pass
+
+def startstub(port=0, latency=0, failures=0.0):                                 # Start stub in a background thread. Returns (server, url). Port 0 picks a free port
+    global latencyms, failrate
+    latencyms = latency; failrate = failures
+    server = ThreadingHTTPServer(("127.0.0.1", port), UnderstandHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/understand"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for the UM1 /understand endpoint")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=int, default=0, help="extra milliseconds of latency per request")
+    parser.add_argument("--failrate", type=float, default=0.0, help="fraction of requests to fail with HTTP 503")
+    args = parser.parse_args()
+    server, url = startstub(args.port, args.latency, args.failrate)
+    print(f"UM1 stub serving {url}  latency: {args.latency} ms  failrate: {args.failrate}")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()